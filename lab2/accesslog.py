@@ -0,0 +1,169 @@
+import collections
+import json
+import os
+import threading
+import time
+
+from metrics import UNMATCHED
+
+# Records waiting for the writer; past this, new ones are dropped and counted
+QUEUE_LIMIT = 8192
+# Queued records that wake the writer before its next flush
+BATCH_SIZE = 512
+# Seconds between flushes when traffic is light
+FLUSH_INTERVAL = 0.5
+# The file is rotated once it grows past this, keeping `backups` older files as path.1, path.2, ...
+MAX_BYTES = 16 << 20
+BACKUPS = 3
+
+
+class AccessLog:
+    """Access records in JSON lines, written to a file by a background thread.
+
+    The event loop only appends a tuple to a bounded deque, never touching the
+    file, and the writer formats and writes whatever has queued in one batch. When
+    the writer falls behind and the queue is full, records are dropped and counted
+    rather than making requests wait.
+    """
+
+    def __init__(self, path, queue_limit=QUEUE_LIMIT, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL, max_bytes=MAX_BYTES, backups=BACKUPS):
+        self.path = path
+        self.queue_limit = queue_limit
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backups = backups
+        # Only the event loop thread appends and counts drops; only the writer pops and counts the rest
+        self.records = collections.deque()
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self.rotations = 0
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = None
+        # JSON-encoded methods and route templates; both come from a small set
+        self._encoded = {}
+
+    def log(self, method, route, status, duration, size):
+        """Queue one record without blocking, dropping it if the queue is full"""
+        if self._thread is None:
+            self._start()
+        records = self.records
+        if len(records) >= self.queue_limit:
+            self.dropped += 1
+            return
+        records.append((time.time(), method, route, status, duration, size))
+        if len(records) == self.batch_size:
+            self._wake.set()
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name="access-log", daemon=True)
+        self._thread.start()
+
+    def _encode(self, value):
+        encoded = self._encoded.get(value)
+        if encoded is None:
+            encoded = self._encoded[value] = json.dumps(value)
+        return encoded
+
+    def format(self, record):
+        """One record as a JSON line"""
+        timestamp, method, route, status, duration, size = record
+        return (
+            f'{{"ts":{timestamp:.3f},"method":{self._encode(method)},"route":{self._encode(route)},'
+            f'"status":{status},"ms":{duration * 1000:.3f},"bytes":{size}}}\n'
+        )
+
+    def _run(self):
+        file = None
+        try:
+            while True:
+                self._wake.wait(self.flush_interval)
+                self._wake.clear()
+                stopping = self._stopping
+                count = len(self.records)
+                if count:
+                    batch = "".join([self.format(self.records.popleft()) for _ in range(count)]).encode()
+                    try:
+                        if file is None:
+                            file = open(self.path, "ab")
+                        file.write(batch)
+                        file.flush()
+                        self.written += count
+                    except OSError:
+                        # A full or missing disk loses this batch, not the writer
+                        self.failed += count
+                        if file is not None:
+                            file.close()
+                            file = None
+                    if file is not None and file.tell() >= self.max_bytes:
+                        file.close()
+                        file = None
+                        try:
+                            self._rotate()
+                        except OSError:
+                            pass
+                if stopping:
+                    return
+        finally:
+            if file is not None:
+                file.close()
+
+    def _rotate(self):
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{index}"):
+                os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.rotations += 1
+
+    def collect(self):
+        """Prometheus samples for Metrics.add_collector"""
+        return [
+            ("access_log_queued", "gauge", "Access records waiting for the writer thread.", {"": len(self.records)}),
+            ("access_log_written_total", "counter", "Access records written.", {"": self.written}),
+            ("access_log_dropped_total", "counter", "Access records dropped because the queue was full.", {"": self.dropped}),
+            ("access_log_failed_total", "counter", "Access records lost to write errors.", {"": self.failed}),
+            ("access_log_rotations_total", "counter", "Times the access log was rotated.", {"": self.rotations}),
+        ]
+
+    def close(self, timeout=5):
+        """Write what is queued and stop the writer"""
+        if self._thread is not None:
+            self._stopping = True
+            self._wake.set()
+            self._thread.join(timeout)
+            self._thread = None
+            self._stopping = False
+
+
+class AccessLogMiddleware:
+    """ASGI middleware queueing an AccessLog record for every HTTP request, labelled by route template"""
+
+    def __init__(self, app, log):
+        self.app = app
+        self.log = log
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+        size = 0
+
+        async def send_wrapper(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.log.log(scope["method"], scope.get("route_template", UNMATCHED), status, time.perf_counter() - start, size)
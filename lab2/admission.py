@@ -0,0 +1,240 @@
+import asyncio
+import collections
+import contextvars
+import json
+import math
+
+from metrics import route_template
+
+# Header a client can send to ask for a shorter deadline than its route class allows, in seconds
+TIMEOUT_HEADER = b"x-request-timeout"
+
+# Offloaded work of the current request, which keeps its slot until the work is done
+_offloaded = contextvars.ContextVar("offloaded", default=None)
+
+
+class Rejected(Exception):
+    """The request was not admitted: the queue was full, or its deadline passed while it waited"""
+
+
+class Gate:
+    """At most `limit` requests at once, with up to `queue_limit` more waiting in arrival order.
+
+    A request arriving to a full queue is rejected right away instead of waiting,
+    and one that is still queued when its deadline passes gives up. A finishing
+    request hands its slot straight to the oldest waiter. Only the event loop
+    thread touches it.
+    """
+
+    def __init__(self, limit, queue_limit, deadline):
+        self.limit = limit
+        self.queue_limit = queue_limit
+        self.deadline = deadline
+        self.active = 0
+        self.admitted = 0
+        self.shed = 0
+        self.expired = 0
+        self.timed_out = 0
+        self._waiters = collections.deque()
+
+    def __len__(self):
+        return len(self._waiters)
+
+    async def acquire(self, deadline_at):
+        """Wait for a slot until deadline_at (loop time), raises Rejected if there is none"""
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return
+        if len(self._waiters) >= self.queue_limit:
+            self.shed += 1
+            raise Rejected(f"{len(self._waiters)} requests already queued")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            async with asyncio.timeout_at(deadline_at):
+                await waiter
+        except BaseException as exc:
+            if waiter.done() and not waiter.cancelled():
+                # Handed a slot just as the deadline hit or the client left; pass it on
+                self.release()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            if isinstance(exc, TimeoutError):
+                self.expired += 1
+                raise Rejected("Deadline passed while queued") from None
+            raise
+        self.admitted += 1
+
+    def release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # The slot moves to the waiter, so active stays the same
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def retry_after(self):
+        """Seconds a rejected client should wait: roughly how long the queue ahead takes to drain"""
+        return max(1, math.ceil(self.deadline * len(self._waiters) / (self.limit + self.queue_limit)))
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "queued": len(self._waiters),
+            "limit": self.limit,
+            "queue_limit": self.queue_limit,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "expired": self.expired,
+            "timed_out": self.timed_out,
+        }
+
+
+def gate_collector(gates):
+    """A Metrics collector for gates keyed by route class, one series per class"""
+
+    def collect():
+        stats = {name: gate.stats() for name, gate in sorted(gates.items())}
+
+        def samples(field):
+            return {f'class="{name}"': values[field] for name, values in stats.items()}
+
+        return [
+            ("admission_active", "gauge", "Requests running, by route class.", samples("active")),
+            ("admission_queue_depth", "gauge", "Requests waiting for a slot, by route class.", samples("queued")),
+            ("admission_limit", "gauge", "Concurrent requests allowed, by route class.", samples("limit")),
+            ("admission_queue_limit", "gauge", "Requests allowed to wait, by route class.", samples("queue_limit")),
+            ("admission_shed_total", "counter", "Requests rejected because the queue was full.", samples("shed")),
+            ("admission_expired_total", "counter", "Requests whose deadline passed while queued.", samples("expired")),
+            ("admission_timed_out_total", "counter", "Requests whose deadline passed before they responded.", samples("timed_out")),
+        ]
+
+    return collect
+
+
+async def offload(awaitable):
+    """Await work running on a thread or process, keeping the request's admission slot until it ends.
+
+    A request past its deadline gets its 504 right away, but the thread or process
+    can't be stopped, so the slot stays taken until the work really finishes and
+    the class limit keeps bounding the work, not just the requests.
+    """
+    task = asyncio.ensure_future(awaitable)
+    # Nobody may be left to see a failure of work the request gave up on
+    task.add_done_callback(lambda task: task.cancelled() or task.exception())
+    offloaded = _offloaded.get()
+    if offloaded is not None:
+        offloaded.append(task)
+    return await asyncio.shield(task)
+
+
+class AdmissionMiddleware:
+    """ASGI middleware putting every HTTP request through the Gate of its route class.
+
+    Routes are assigned classes by template in `route_classes`, anything else is in
+    `default`, and routes mapped to None (e.g. /metrics) skip admission. A request
+    has its class deadline, or less if the client asks with X-Request-Timeout, to
+    start its response: past it, a queued request gets 503 and a running one 504.
+    Once the response has started it runs to completion. Work a route hands to a
+    thread or process through offload holds the slot until it finishes.
+    """
+
+    def __init__(self, app, gates, route_classes, router, default="default"):
+        self.app = app
+        self.gates = gates
+        self.route_classes = route_classes
+        self.router = router
+        self.default = default
+
+    def deadline(self, scope, gate):
+        seconds = gate.deadline
+        for name, value in scope["headers"]:
+            if name == TIMEOUT_HEADER:
+                try:
+                    seconds = min(seconds, max(float(value), 0.0))
+                except ValueError:
+                    pass
+                break
+        return asyncio.get_running_loop().time() + seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        template = scope.get("route_template") or route_template(self.router, scope)
+        gate = self.gates.get(self.route_classes.get(template, self.default))
+        if gate is None:
+            await self.app(scope, receive, send)
+            return
+
+        deadline_at = self.deadline(scope, gate)
+        try:
+            await gate.acquire(deadline_at)
+        except Rejected as exc:
+            await respond(send, 503, str(exc), gate.retry_after())
+            return
+
+        # A plain timer cancelling the task is cheaper per request than asyncio.timeout_at plus a reschedule
+        task = asyncio.current_task()
+        expired = started = False
+
+        def expire():
+            nonlocal expired
+            expired = True
+            task.cancel()
+
+        timer = asyncio.get_running_loop().call_at(deadline_at, expire)
+
+        async def send_wrapper(message):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+                # The deadline covers getting an answer going, not streaming it
+                timer.cancel()
+            await send(message)
+
+        offloaded = []
+        context_token = _offloaded.set(offloaded)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except asyncio.CancelledError:
+            # Anyone else cancelling the task (e.g. the server on shutdown) still wins
+            if not expired or task.uncancel():
+                raise
+            # Work the handler passed to a thread keeps running there; only the request gives up
+            gate.timed_out += 1
+            if not started:
+                await respond(send, 504, "Deadline passed before the response started")
+        finally:
+            timer.cancel()
+            _offloaded.reset(context_token)
+            release_after(gate, [task for task in offloaded if not task.done()])
+
+
+def release_after(gate, tasks):
+    """Release gate's slot once every task is done, or right away if there are none"""
+    if not tasks:
+        gate.release()
+        return
+    remaining = len(tasks)
+
+    def done(task):
+        nonlocal remaining
+        remaining -= 1
+        if not remaining:
+            gate.release()
+
+    for task in tasks:
+        task.add_done_callback(done)
+
+
+async def respond(send, status, detail, retry_after=None):
+    body = json.dumps({"detail": detail}).encode()
+    headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    if retry_after is not None:
+        headers.append((b"retry-after", str(retry_after).encode()))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
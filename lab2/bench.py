@@ -0,0 +1,555 @@
+import argparse
+import asyncio
+import collections
+import gc
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+import primes
+from tokens import TokenSigner
+
+
+def timeit(fn, repeat):
+    """Run fn() repeat times and return the mean cost per call in microseconds"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def next_prime(n):
+    while not primes.is_prime(n):
+        n += 1
+    return n
+
+
+def prime(args):
+    # Cost per call of the primality engine for primes of growing size
+    print(f"{'digits':>6} {'method':>14} {'us/call':>10}")
+    for digits in args.digits:
+        n = next_prime(10 ** (digits - 1) + 1)
+        _, method = primes.check(n)
+        cost = timeit(lambda: primes.check(n), args.repeat)
+        print(f"{digits:>6} {method:>14} {cost:>10.2f}")
+
+
+def tokens(args):
+    # Cost of authenticating one request with the verified-token cache on and off
+    for cache_size in (4096, 0):
+        signer = TokenSigner(b"bench-secret", cache_size=cache_size)
+        issued = [signer.issue(f"user{i}") for i in range(args.users)]
+        calls = iter(issued * (args.repeat // args.users + 1))
+        cost = timeit(lambda: signer.verify(next(calls)), args.repeat)
+        print(f"cache {'on ' if cache_size else 'off'} {cost:>8.2f} us/verify")
+
+
+async def asgi_call(app, method, path, query=b"", headers=(), body=b"", client=("127.0.0.1", 50000)):
+    """Drive one request through the ASGI app in-process and return (status, headers, body)"""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query,
+        "root_path": "",
+        "headers": [(name.lower().encode(), value.encode()) for name, value in headers],
+        "client": client,
+        "server": ("testserver", 80),
+    }
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    response = {"status": None, "headers": [], "body": b""}
+
+    async def receive():
+        return messages.pop() if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["headers"] = message["headers"]
+        elif message["type"] == "http.response.body":
+            response["body"] += message.get("body", b"")
+
+    await app(scope, receive, send)
+    return response["status"], response["headers"], response["body"]
+
+
+JSON_ROUTES = [
+    ("/", b""),
+    ("/hello", b"name=Alice"),
+    ("/sum/3/5", b""),
+    ("/weather", b""),
+    ("/weather", b"city=Paris"),
+    ("/length/hello", b""),
+    ("/prime/17", b""),
+]
+
+
+def json_throughput(args):
+    # Requests per second through the whole app, response cache off so every call encodes
+    import main
+
+    app = main.create_app()
+    app.state.response_cache.maxsize = 0
+
+    async def run():
+        for path, query in JSON_ROUTES:
+            await asgi_call(app, "GET", path, query)
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                await asgi_call(app, "GET", path, query)
+            rate = args.repeat / (time.perf_counter() - start)
+            label = path + ("?" + query.decode() if query else "")
+            print(f"{label:<20} {rate:>10.0f} req/s")
+
+    asyncio.run(run())
+
+
+def route_cases(app):
+    """One request factory per route, keyed "METHOD /template"; each takes the iteration number"""
+    batch = json.dumps(list(range(1000))).encode()
+    document = "Grüße, 世界! 🌍\n".encode() * 4096
+    packed = bytes(range(256)) * 4096
+    json_headers = [("content-type", "application/json")]
+    run = int(time.time())
+    return {
+        "GET /": lambda i: ("GET", "/", b"", [], b""),
+        "GET /hello": lambda i: ("GET", "/hello", f"name=user{i}".encode(), [], b""),
+        # Pure routes get fresh inputs so the response cache can't hide compute regressions
+        "GET /sum/{one}/{two}": lambda i: ("GET", f"/sum/{i}/{run}", b"", [], b""),
+        # Two 64K-element int64 vectors added elementwise
+        "POST /sum": lambda i: ("POST", "/sum", b"", [("content-type", "application/octet-stream")], packed),
+        # Alternate exact titles and case variants, which both resolve through the title index
+        "GET /wiki/{topic:path}": lambda i: ("GET", ("/wiki/Python_(programming_language)", "/wiki/boston_red_sox")[i % 2], b"", [], b""),
+        "GET /wiki-suggest": lambda i: ("GET", "/wiki-suggest", b"prefix=bos", [], b""),
+        "GET /weather": lambda i: ("GET", "/weather", f"city=city{run}-{i}".encode(), [], b""),
+        "GET /length/{text}": lambda i: ("GET", f"/length/text{run}-{i}", b"", [], b""),
+        "POST /length": lambda i: ("POST", "/length", b"", [("content-type", "text/plain; charset=utf-8")], document),
+        "GET /prime/{number}": lambda i: ("GET", f"/prime/{10 ** 17 + run * 100000 + 2 * i + 1}", b"", [], b""),
+        "GET /cache-stats": lambda i: ("GET", "/cache-stats", b"", [], b""),
+        "GET /metrics": lambda i: ("GET", "/metrics", b"", [], b""),
+        "POST /prime/batch": lambda i: ("POST", "/prime/batch", b"", json_headers, batch),
+        "GET /primes/{start}/{end}": lambda i: ("GET", "/primes/0/10000", b"", [], b""),
+        "POST /register": lambda i: ("POST", "/register", b"", json_headers, json.dumps({"name": f"bench{run}-{i}", "pin": i}).encode()),
+        "POST /login": lambda i: ("POST", "/login", b"", json_headers, BENCH_LOGIN),
+        "GET /users": lambda i: ("GET", "/users", b"limit=100", [("cookie", f"token={app.state.bench_token}")], b""),
+        "GET /users-header": lambda i: ("GET", "/users-header", b"limit=100", [("authorization", f"Bearer {app.state.bench_token}")], b""),
+        # Only routed when the app has a profile token
+        "GET /profiles": lambda i: ("GET", "/profiles", b"", [("x-profile-token", app.state.profiler.token.decode())], b""),
+        "GET /profiles/collapsed": lambda i: ("GET", "/profiles/collapsed", b"", [("x-profile-token", app.state.profiler.token.decode())], b""),
+    }
+
+
+# A user whose PIN hash is as cheap as scrypt allows, so route benchmarks time the route rather than the hash
+BENCH_LOGIN = b'{"name": "bench-login", "pin": 28}'
+
+
+async def add_bench_login(app):
+    """Register the BENCH_LOGIN user with the app's PIN hashing turned down to its cheapest"""
+    app.state.pin_hasher.n = 2
+    await asgi_call(app, "POST", "/register", b"", [("content-type", "application/json")], BENCH_LOGIN)
+
+
+def client_address(i):
+    return (f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}", 50000)
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def routes(args):
+    # ops/sec and p50/p99 for every route of main.app, optionally checked against a saved baseline
+    import main
+    import wikiindex
+    from fastapi.routing import APIRoute
+
+    # /wiki is timed against the bundled sample index unless a real one is configured
+    os.environ.setdefault("WIKI_INDEX", wikiindex.sample_index())
+    cases = route_cases(main.app)
+    names = [f"{method} {route.path}" for route in main.app.routes if isinstance(route, APIRoute) for method in sorted(route.methods)]
+    missing = [name for name in names if name not in cases]
+    if missing:
+        print("No benchmark case for: " + ", ".join(missing))
+        sys.exit(1)
+
+    async def run():
+        await add_bench_login(main.app)
+        _, _, body = await asgi_call(main.app, "POST", "/login", b"", [("content-type", "application/json")], BENCH_LOGIN)
+        main.app.state.bench_token = json.loads(body)["token"]
+        results = {}
+        for name in names:
+            case = cases[name]
+            for i in range(args.warmup):
+                await asgi_call(main.app, *case(-1 - i), client=client_address(-1 - i))
+            # Best of several rounds, so a noisy neighbour doesn't read as a regression
+            best = None
+            for round_number in range(args.rounds):
+                latencies = []
+                gc.disable()
+                start = time.perf_counter()
+                for i in range(round_number * args.repeat, (round_number + 1) * args.repeat):
+                    call_start = time.perf_counter()
+                    # A different client address per call, so the rate limited routes measure their bucket lookup, not 429s
+                    status, _, _ = await asgi_call(main.app, *case(i), client=client_address(i))
+                    latencies.append(time.perf_counter() - call_start)
+                    if status >= 400:
+                        raise SystemExit(f"{name} answered {status}")
+                total = time.perf_counter() - start
+                gc.enable()
+                latencies.sort()
+                result = {
+                    "ops": args.repeat / total,
+                    "p50_us": percentile(latencies, 0.50) * 1e6,
+                    "p99_us": percentile(latencies, 0.99) * 1e6,
+                }
+                if best is None or result["ops"] > best["ops"]:
+                    best = result
+            results[name] = best
+        return results
+
+    results = asyncio.run(run())
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["routes"]
+
+    regressions = []
+    print(f"{'route':<28} {'ops/s':>9} {'p50 us':>9} {'p99 us':>9} {'vs base':>8}")
+    for name, result in results.items():
+        change = ""
+        if baseline and name in baseline:
+            ratio = result["ops"] / baseline[name]["ops"]
+            change = f"{(ratio - 1) * 100:+.0f}%"
+            # Throughput or median latency past the threshold counts as a regression
+            if ratio < 1 - args.threshold or result["p50_us"] > baseline[name]["p50_us"] * (1 + args.threshold):
+                regressions.append(name)
+                change += " !"
+        print(f"{name:<28} {result['ops']:>9.0f} {result['p50_us']:>9.1f} {result['p99_us']:>9.1f} {change:>8}")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"python": platform.python_version(), "repeat": args.repeat, "rounds": args.rounds, "routes": results}, f, indent=2)
+        print(f"Saved baseline to {args.save}")
+    if regressions:
+        print(f"Regressed past {args.threshold:.0%}: " + ", ".join(regressions))
+        sys.exit(1)
+
+
+def ratelimit(args):
+    # Per-request cost of the token buckets, alone and through /login
+    from ratelimit import RateLimiter
+
+    limiter = RateLimiter(rate=1e9, burst=1e9, maxsize=args.maxsize)
+    clients = [f"10.0.{i >> 8 & 255}.{i & 255}" for i in range(args.clients)]
+    calls = iter(clients * (args.repeat // args.clients + 1))
+    cost = timeit(lambda: limiter.acquire(next(calls)), args.repeat)
+    print(f"{f'acquire, {args.clients} clients, {args.maxsize} buckets':<40} {cost:>8.2f} us/call")
+
+    import main
+
+    login = ("POST", "/login", b"", [("content-type", "application/json")], BENCH_LOGIN)
+    for label, limits in (("off", {}), ("on", {"/login": (1e9, 1e9)})):
+        app = main.create_app(rate_limits=limits)
+
+        async def run():
+            await add_bench_login(app)
+            await asgi_call(app, *login)
+            start = time.perf_counter()
+            for i in range(args.requests):
+                await asgi_call(app, *login, client=client_address(i % args.clients))
+            return (time.perf_counter() - start) / args.requests * 1e6
+
+        print(f"{f'POST /login, limiter {label}':<40} {asyncio.run(run()):>8.2f} us/request")
+
+
+def accesslog(args):
+    # GET / cost with no access log, with AccessLog's writer thread, and with a logging.FileHandler on the event loop
+    import logging
+    import tempfile
+    import main
+    from accesslog import AccessLog
+
+    class LoggingAccessLog:
+        """The plain logging call the writer thread replaces: formatted and written on the event loop"""
+
+        def __init__(self, path):
+            self.handler = logging.FileHandler(path)
+            self.logger = logging.Logger("bench.access")
+            self.logger.addHandler(self.handler)
+
+        def log(self, method, route, status, duration, size):
+            self.logger.warning('{"method":"%s","route":"%s","status":%d,"ms":%.3f,"bytes":%d}', method, route, status, duration * 1000, size)
+
+        def collect(self):
+            return []
+
+        def close(self):
+            self.handler.close()
+
+    root = ("GET", "/", b"", [], b"")
+    with tempfile.TemporaryDirectory() as directory:
+        logs = {
+            "off": None,
+            "writer thread": AccessLog(os.path.join(directory, "thread.log"), max_bytes=args.max_bytes),
+            "logging on the loop": LoggingAccessLog(os.path.join(directory, "logging.log")),
+        }
+        for label, log in logs.items():
+            app = main.create_app(access_log=log)
+
+            async def run():
+                for _ in range(100):
+                    await asgi_call(app, *root)
+                start = time.perf_counter()
+                for _ in range(args.requests):
+                    await asgi_call(app, *root)
+                return (time.perf_counter() - start) / args.requests * 1e6
+
+            cost = asyncio.run(run())
+            print(f"{f'GET /, access log {label}':<40} {cost:>8.2f} us/request")
+            if log is not None:
+                log.close()
+            if isinstance(log, AccessLog):
+                print(f"{'':<40} {log.written} written, {log.dropped} dropped, {log.rotations} rotations")
+
+
+def logins(args):
+    # / latency while a storm of /login requests hashes PINs, with hashing on the worker pool and on the event loop
+    import main
+    from pins import PinHasher
+
+    class InlineHasher(PinHasher):
+        """Hashes on the event loop, as /login did before the worker pool"""
+
+        async def _run(self, func, *args):
+            self.completed += 1
+            return func(*args)
+
+    root = ("GET", "/", b"", [], b"")
+    login = ("POST", "/login", b"", [("content-type", "application/json")], b'{"name": "caua", "pin": 28}')
+
+    async def run(hasher, storm):
+        app = main.create_app(rate_limits={}, pin_hasher=hasher)
+        # The first login loads the user store and token signer, a one-off stall that isn't the storm's doing
+        await asgi_call(app, *root)
+        await asgi_call(app, *login)
+        statuses = collections.Counter()
+        done = False
+
+        async def client(k):
+            while not done:
+                status, _, _ = await asgi_call(app, *login, client=client_address(k))
+                statuses[status] += 1
+                # Shed clients back off as Retry-After asks, only shorter and jittered; the rest still yield, as a socket read would
+                await asyncio.sleep(random.uniform(0, 2 * args.backoff) if status == 503 else 0)
+
+        clients = [asyncio.create_task(client(k)) for k in range(args.clients if storm else 0)]
+        # All clients arrive at once; probe the storm once that first burst has been queued or shed
+        await asyncio.sleep(0.5)
+        statuses.clear()
+        # Probes are due on a fixed schedule and timed from when they were due, so time spent waiting for a blocked loop counts
+        latencies = []
+        start = due = time.perf_counter()
+        end = start + args.duration
+        while due < end:
+            await asyncio.sleep(max(due - time.perf_counter(), 0))
+            await asgi_call(app, *root)
+            finished = time.perf_counter()
+            # Probes that fell due while this one waited could not have finished any sooner
+            while due <= finished and due < end:
+                latencies.append(finished - due)
+                due += args.interval
+        done = True
+        await asyncio.gather(*clients)
+        hasher.close()
+        return sorted(latencies), statuses
+
+    print(f"{'GET / while':<28} {'p50 us':>9} {'p99 us':>9} {'max us':>9} {'logins/s':>9} {'shed/s':>9}")
+    for label, hasher, storm in (
+        ("idle", PinHasher(), False),
+        ("login storm, worker pool", PinHasher(workers=args.workers, queue_limit=args.queue_limit), True),
+        ("login storm, on the loop", InlineHasher(), True),
+    ):
+        latencies, statuses = asyncio.run(run(hasher, storm))
+        print(
+            f"{label:<28} {percentile(latencies, 0.50) * 1e6:>9.0f} {percentile(latencies, 0.99) * 1e6:>9.0f} {latencies[-1] * 1e6:>9.0f}"
+            f" {statuses[200] / args.duration:>9.1f} {statuses[503] / args.duration:>9.1f}"
+        )
+
+
+def weather(args):
+    # /weather latency while a slow stub upstream is refreshed behind it
+    import main
+    from weather import HTTPWeatherProvider
+    from weather_stub import start_stub
+
+    stub = start_stub(delay=args.delay)
+    cities = [f"city{i}".encode() for i in range(args.cities)]
+
+    async def run():
+        app = main.create_app(weather_provider=HTTPWeatherProvider(stub.url, timeout=args.delay + 1))
+        app.state.weather.ttl = args.ttl
+        # Cold cities wait for the upstream once, concurrently
+        await asyncio.gather(*[asgi_call(app, "GET", "/weather", b"city=" + city) for city in cities])
+        latencies = []
+        deadline = time.perf_counter() + args.duration
+        i = 0
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            status, _, _ = await asgi_call(app, "GET", "/weather", b"city=" + cities[i % len(cities)])
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                raise SystemExit(f"/weather answered {status}")
+            i += 1
+            # Yield now and then so background refreshes make progress, as they would between real requests
+            if i % 100 == 0:
+                await asyncio.sleep(0)
+        await app.state.weather.aclose()
+        return latencies, app.state.weather.stats()
+
+    latencies, stats = asyncio.run(run())
+    stub.stop()
+    latencies.sort()
+    print(f"{len(latencies)} requests over {args.cities} cities, upstream delay {args.delay * 1000:.0f} ms, ttl {args.ttl} s")
+    print(f"p50 {percentile(latencies, 0.50) * 1e6:.1f} us, p99 {percentile(latencies, 0.99) * 1e6:.1f} us, max {latencies[-1] * 1e6:.1f} us")
+    print(f"upstream requests {stub.requests}, stale answers {stats['stale']}, errors {stats['errors']}")
+
+
+# Run in a fresh interpreter under -X importtime; stderr gets the per-module import report,
+# stdout the phase timings of a worker's cold start
+STARTUP_PROBE = """
+import asyncio, json, os, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+os.write(2, b"-- imported\\n")
+app = main.app
+built = time.perf_counter()
+import bench
+requested = time.perf_counter()
+asyncio.run(bench.asgi_call(app, "GET", "/"))
+done = time.perf_counter()
+print(json.dumps({"import": imported - start, "build": built - imported, "first_request": done - requested}))
+"""
+
+
+def parse_importtime(report):
+    """Self time in microseconds per module from a -X importtime report, up to the probe's marker"""
+    costs = {}
+    for line in report.splitlines():
+        if line.startswith("-- imported"):
+            break
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        fields = line.removeprefix("import time:").split("|")
+        if not fields[0].strip().isdigit():
+            continue  # the column header
+        costs[fields[2].strip()] = int(fields[0])
+    return costs
+
+
+def startup(args):
+    # Cold start of a new worker: per-module import cost, building main.app and serving its first request
+    here = os.path.dirname(os.path.abspath(__file__))
+    modules, phases = {}, {}
+    for _ in range(args.runs):
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", STARTUP_PROBE], cwd=here, capture_output=True, text=True, check=True)
+        # The minimum over runs of each cost is the least noisy estimate
+        for name, cost in parse_importtime(proc.stderr).items():
+            modules[name] = min(modules.get(name, cost), cost)
+        for name, seconds in json.loads(proc.stdout.splitlines()[-1]).items():
+            phases[name] = min(phases.get(name, seconds), seconds)
+
+    # Fold submodules into their top-level package, so the report names what main pulls in
+    packages = {}
+    for name, cost in modules.items():
+        root = name.split(".")[0]
+        packages[root] = packages.get(root, 0) + cost
+    total = sum(packages.values())
+    print(f"{'module':<24} {'ms':>8} {'share':>6}")
+    for name, cost in sorted(packages.items(), key=lambda item: -item[1])[: args.top]:
+        print(f"{name:<24} {cost / 1000:>8.1f} {cost / total:>6.0%}")
+    print()
+    for name, seconds in phases.items():
+        print(f"{name:<24} {seconds * 1000:>8.1f} ms")
+    cold_start = sum(phases.values()) * 1000
+    print(f"{'cold start':<24} {cold_start:>8.1f} ms")
+    if args.budget is not None and cold_start > args.budget:
+        print(f"Cold start is over the {args.budget:.0f} ms budget")
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks for the lab2 app internals.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    sp = subparsers.add_parser("prime", help="Primality engine cost per call by input size")
+    sp.add_argument("--digits", type=int, nargs="+", default=[3, 6, 9, 12, 15, 18, 19, 30, 100], help="Input sizes in decimal digits")
+    sp.add_argument("--repeat", type=int, default=2000, help="Calls per size")
+    sp.set_defaults(func=prime)
+
+    sp = subparsers.add_parser("tokens", help="Token verification cost with the cache on and off")
+    sp.add_argument("--users", type=int, default=100, help="Distinct tokens in rotation")
+    sp.add_argument("--repeat", type=int, default=100000, help="Verifications per run")
+    sp.set_defaults(func=tokens)
+
+    sp = subparsers.add_parser("json", help="In-process requests/sec of the JSON routes (response cache off)")
+    sp.add_argument("--repeat", type=int, default=5000, help="Requests per route")
+    sp.set_defaults(func=json_throughput)
+
+    sp = subparsers.add_parser("routes", help="ops/sec and p50/p99 of every route; fails on regressions against a baseline")
+    sp.add_argument("--repeat", type=int, default=1000, help="Requests per route")
+    sp.add_argument("--rounds", type=int, default=5, help="Timed rounds per route, the best one is kept")
+    sp.add_argument("--warmup", type=int, default=50, help="Untimed requests per route first")
+    sp.add_argument("--save", help="Write the results as a JSON baseline to this path")
+    sp.add_argument("--baseline", help="Compare against a JSON baseline saved earlier")
+    sp.add_argument("--threshold", type=float, default=0.25, help="Allowed slowdown as a fraction (default=0.25)")
+    sp.set_defaults(func=routes)
+
+    sp = subparsers.add_parser("ratelimit", help="Per-request overhead of the rate limiter")
+    sp.add_argument("--clients", type=int, default=20000, help="Distinct client addresses in rotation")
+    sp.add_argument("--maxsize", type=int, default=10000, help="Buckets kept per route")
+    sp.add_argument("--repeat", type=int, default=200000, help="Bucket lookups")
+    sp.add_argument("--requests", type=int, default=5000, help="Requests through /login per run")
+    sp.set_defaults(func=ratelimit)
+
+    sp = subparsers.add_parser("accesslog", help="Per-request cost of the access log, on a writer thread vs logging on the event loop")
+    sp.add_argument("--requests", type=int, default=20000, help="Requests through / per run")
+    sp.add_argument("--max-bytes", type=int, default=1 << 20, help="Rotate the log past this size (default=1 MiB)")
+    sp.set_defaults(func=accesslog)
+
+    sp = subparsers.add_parser("logins", help="GET / latency during a /login storm, PIN hashing on the worker pool vs on the event loop")
+    sp.add_argument("--clients", type=int, default=64, help="Concurrent clients logging in back to back")
+    sp.add_argument("--workers", type=int, default=2, help="PIN hashing threads")
+    sp.add_argument("--queue-limit", type=int, default=32, help="PIN hashes allowed to wait before logins are shed")
+    sp.add_argument("--backoff", type=float, default=0.1, help="Seconds a shed client waits before retrying")
+    sp.add_argument("--interval", type=float, default=0.005, help="Seconds between GET / probes")
+    sp.add_argument("--duration", type=float, default=3.0, help="Seconds per scenario")
+    sp.set_defaults(func=logins)
+
+    sp = subparsers.add_parser("weather", help="/weather latency against a slow stub upstream (stale-while-revalidate)")
+    sp.add_argument("--delay", type=float, default=0.2, help="Stub upstream delay in seconds")
+    sp.add_argument("--ttl", type=float, default=0.5, help="Weather cache TTL in seconds, short so reports go stale during the run")
+    sp.add_argument("--cities", type=int, default=20, help="Distinct cities in rotation")
+    sp.add_argument("--duration", type=float, default=3.0, help="Seconds to run")
+    sp.set_defaults(func=weather)
+
+    sp = subparsers.add_parser("startup", help="Per-module import cost and cold start time of a fresh worker")
+    sp.add_argument("--runs", type=int, default=5, help="Fresh interpreters to start, the fastest of each cost is kept")
+    sp.add_argument("--top", type=int, default=15, help="Modules to list")
+    sp.add_argument("--budget", type=float, help="Fail when the cold start takes more milliseconds than this")
+    sp.set_defaults(func=startup)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
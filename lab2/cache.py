@@ -0,0 +1,149 @@
+import asyncio
+import functools
+import hashlib
+import inspect
+import threading
+import time
+from collections import OrderedDict
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+# Headers that belong to the wire format rather than the cached representation
+SKIPPED_HEADERS = {"content-length", "content-type"}
+# Headers describing the work of one response; only the MISS that did the work sends them
+PER_RESPONSE_HEADERS = {"server-timing"}
+
+
+class ResponseCache:
+    """Bounded LRU of pre-serialized JSON responses with a TTL, for routes that are pure functions of their inputs.
+
+    Concurrent misses for the same key are coalesced: the first one computes the
+    response and the others wait for it instead of computing it again.
+    """
+
+    def __init__(self, maxsize=4096, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        # key -> (expires_at, body, headers)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # key -> future of the entry being computed; only touched from the event loop
+        self._flights = {}
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "coalesced": self.coalesced, "size": len(self._entries), "maxsize": self.maxsize}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def _put(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def _respond(self, request, entry, status, fresh=None):
+        expires_at, body, headers = entry
+        headers = dict(headers)
+        if fresh:
+            headers.update(fresh)
+        headers["Cache-Control"] = f"public, max-age={max(0, int(expires_at - time.monotonic()))}"
+        headers["X-Cache"] = status
+        if request.headers.get("if-none-match") == headers["ETag"]:
+            return Response(status_code=304, headers=headers)
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    def _entry(self, result, responses, ttl):
+        """The cache entry for result, and the per-response headers kept out of it; (None, None) if uncacheable"""
+        if isinstance(result, Response):
+            # Handlers may return pre-encoded JSON; anything else is passed through uncached
+            if result.status_code != 200 or result.media_type != "application/json":
+                return None, None
+            body = result.body
+            responses = responses + [result]
+        else:
+            body = JSONResponse(jsonable_encoder(result)).body
+        headers = {"ETag": '"' + hashlib.blake2b(body, digest_size=8).hexdigest() + '"'}
+        fresh = {}
+        for source in responses:
+            for header, value in source.headers.items():
+                if header in PER_RESPONSE_HEADERS:
+                    fresh[header] = value
+                elif header not in SKIPPED_HEADERS:
+                    headers[header] = value
+        return (time.monotonic() + ttl, body, headers), fresh
+
+    def cached(self, ttl=None):
+        """Route decorator (placed under @app.get): serve repeated calls with the same arguments from the cache"""
+        ttl = self.ttl if ttl is None else ttl
+
+        def decorate(func):
+            signature = inspect.signature(func)
+            # Request/Response parameters are injected by FastAPI and are not part of the key
+            key_names = [name for name, p in signature.parameters.items() if p.annotation not in (Request, Response)]
+            response_names = [name for name, p in signature.parameters.items() if p.annotation is Response]
+            request_names = [name for name, p in signature.parameters.items() if p.annotation is Request]
+            request_name = request_names[0] if request_names else "_cache_request"
+            parameters = list(signature.parameters.values())
+            if not request_names:
+                parameters.append(inspect.Parameter(request_name, inspect.Parameter.KEYWORD_ONLY, annotation=Request))
+
+            @functools.wraps(func)
+            async def wrapper(**kwargs):
+                request = kwargs[request_name] if request_names else kwargs.pop(request_name)
+                key = (func.__name__,) + tuple(kwargs[name] for name in key_names)
+                entry = self._get(key)
+                if entry is not None:
+                    self.hits += 1
+                    return self._respond(request, entry, "HIT")
+
+                flight = self._flights.get(key)
+                if flight is not None:
+                    # The same call is already running: share its result instead of computing it again
+                    self.coalesced += 1
+                    entry = await asyncio.shield(flight)
+                    if entry is not None:
+                        return self._respond(request, entry, "COALESCED")
+                    # The result was not cacheable or the call failed, so this request runs it too
+                    return await func(**kwargs)
+
+                self.misses += 1
+                flight = self._flights[key] = asyncio.get_running_loop().create_future()
+                entry = None
+                try:
+                    result = await func(**kwargs)
+                    entry, fresh = self._entry(result, [kwargs[name] for name in response_names], ttl)
+                    if entry is not None:
+                        self._put(key, entry)
+                finally:
+                    del self._flights[key]
+                    flight.set_result(entry)
+                if entry is None:
+                    return result
+                return self._respond(request, entry, "MISS", fresh)
+
+            wrapper.__signature__ = signature.replace(parameters=parameters)
+            return wrapper
+
+        return decorate
@@ -1,76 +1,330 @@
 import argparse
+import contextlib
+import json
+import math
+import random
 import requests
+import struct
 import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 BASE_URL = "http://127.0.0.1:8000"
+# Bytes per chunk when streaming a request body
+LENGTH_CHUNK = 1 << 16
 
 
-def root(args):
-    resp = requests.get(f"{BASE_URL}/")
-    print(resp.json())
+def root(args, http=requests):
+    resp = http.get(f"{BASE_URL}/")
+    return resp.json()
 
 
-def hello(args):
-    resp = requests.get(f"{BASE_URL}/hello", params={"name": args.name})
-    print(resp.json())
+def hello(args, http=requests):
+    resp = http.get(f"{BASE_URL}/hello", params={"name": args.name})
+    return resp.json()
 
 
-def sum_route(args):
-    resp = requests.get(f"{BASE_URL}/sum/{args.one}/{args.two}")
-    print(resp.json())
+def sum_route(args, http=requests):
+    resp = http.get(f"{BASE_URL}/sum/{args.one}/{args.two}")
+    return resp.json()
 
 
-def wiki(args):
-    resp = requests.get(f"{BASE_URL}/wiki/{args.topic}", allow_redirects=False)
+def sum_vectors(args, http=requests):
+    # Vectors go out packed little-endian, one after another; an elementwise sum comes back the same way
+    code, kind = ("q", int) if args.dtype == "int64" else ("d", float)
+    length = len(args.vector[0])
+    if any(len(vector) != length for vector in args.vector):
+        sys.exit("All vectors must have the same length")
+    # Values stay strings until the dtype is known, so int64 ones above 2**53 aren't rounded through float
+    try:
+        vectors = [list(map(kind, vector)) for vector in args.vector]
+    except ValueError as e:
+        sys.exit(f"Not a valid {args.dtype} vector: {e}")
+    body = b"".join(struct.pack(f"<{length}{code}", *vector) for vector in vectors)
+    params = {"op": args.op, "dtype": args.dtype}
+    if args.op == "add":
+        params["count"] = len(args.vector)
+    resp = http.post(f"{BASE_URL}/sum", params=params, data=body, headers={"Content-Type": "application/octet-stream"})
+    if args.op != "add" or resp.status_code != 200:
+        return resp.json()
+    return {"count": length, "sum": list(struct.unpack(f"<{length}{code}", resp.content))}
+
+
+def wiki(args, http=requests):
+    resp = http.get(f"{BASE_URL}/wiki/{args.topic}", allow_redirects=False)
     if resp.status_code in (302, 307):
-        print({"redirect_to": resp.headers.get("location")})
+        return {"redirect_to": resp.headers.get("location")}
+    return resp.json()
+
+
+def wiki_suggest(args, http=requests):
+    resp = http.get(f"{BASE_URL}/wiki-suggest", params={"prefix": args.prefix, "limit": args.limit})
+    return resp.json()
+
+
+def weather(args, http=requests):
+    resp = http.get(f"{BASE_URL}/weather", params={"city": args.city})
+    return resp.json()
+
+
+def length(args, http=requests):
+    resp = http.get(f"{BASE_URL}/length/{args.text}")
+    return resp.json()
+
+
+def length_file(args, http=requests):
+    # Streamed as a chunked body, so neither side holds the whole file
+    def chunks(f):
+        while chunk := f.read(LENGTH_CHUNK):
+            yield chunk
+
+    if args.file == "-":
+        resp = http.post(f"{BASE_URL}/length", data=chunks(sys.stdin.buffer))
     else:
-        print(resp.json())
+        with open(args.file, "rb") as f:
+            resp = http.post(f"{BASE_URL}/length", data=chunks(f))
+    return resp.json()
 
 
-def weather(args):
-    resp = requests.get(f"{BASE_URL}/weather", params={"city": args.city})
-    print(resp.json())
+def prime(args, http=requests):
+    resp = http.get(f"{BASE_URL}/prime/{args.number}")
+    return resp.json()
 
 
-def length(args):
-    resp = requests.get(f"{BASE_URL}/length/{args.text}")
-    print(resp.json())
+def prime_batch(args, http=requests):
+    resp = http.post(f"{BASE_URL}/prime/batch", json=args.numbers)
+    return resp.json()
 
 
-def prime(args):
-    resp = requests.get(f"{BASE_URL}/prime/{args.number}")
-    print(resp.json())
+def prime_range(args, http=requests):
+    # Print primes as the server streams them, one per line
+    resp = http.get(f"{BASE_URL}/primes/{args.start}/{args.end}", stream=True)
+    for line in resp.iter_lines():
+        print(line.decode())
 
 
-def register(args):
+def register(args, http=requests):
     payload = {"name": args.name, "pin": args.pin}
-    resp = requests.post(f"{BASE_URL}/register", json=payload)
-    print(resp.json())
+    resp = http.post(f"{BASE_URL}/register", json=payload)
+    return resp.json()
 
 
-def login(args):
+def login(args, http=requests):
     payload = {"name": args.name, "pin": args.pin}
-    resp = requests.post(f"{BASE_URL}/login", json=payload)
-    print(resp.json())
+    resp = http.post(f"{BASE_URL}/login", json=payload)
+    return resp.json()
 
 
-def users_cookie(args):
+def page_params(args):
+    params = {"after": args.after}
+    if args.limit is not None:
+        params["limit"] = args.limit
+    return params
+
+
+def users_cookie(args, http=requests):
     cookies = {}
     if args.token:
         cookies["token"] = args.token
-    resp = requests.get(f"{BASE_URL}/users", cookies=cookies)
-    print(resp.json())
+    resp = http.get(f"{BASE_URL}/users", params=page_params(args), cookies=cookies)
+    return resp.json()
 
 
-def users_header(args):
+def users_header(args, http=requests):
     # send header "Authorization: Bearer <token>"
     headers = {"Authorization": f"Bearer {args.token}"}
-    resp = requests.get(f"{BASE_URL}/users-header", headers=headers)
-    print(resp.json())
-
-
-def main():
+    resp = http.get(f"{BASE_URL}/users-header", params=page_params(args), headers=headers)
+    return resp.json()
+
+
+def profiles(args, http=requests):
+    # The admin token set with PROFILE_TOKEN on the server
+    headers = {"X-Profile-Token": args.token}
+    params = {key: value for key, value in (("route", args.route), ("id", args.id)) if value is not None}
+    if args.collapsed:
+        resp = http.get(f"{BASE_URL}/profiles/collapsed", params=params, headers=headers)
+        return resp.text.rstrip("\n")
+    resp = http.get(f"{BASE_URL}/profiles", params={"route": args.route} if args.route else None, headers=headers)
+    return resp.json()
+
+
+# "primes" prints as it streams, "batch" would nest, "load" runs its own workers and
+# "length-file" would read the batch's own stdin by default, so batch lines can't use them
+BATCH_EXCLUDED = {"primes", "batch", "load", "length-file"}
+
+
+def batch_argv(operation):
+    # {"op": "sum", "one": 1, "two": 2} -> ["sum", "--one", "1", "--two", "2"]
+    argv = [operation.pop("op")]
+    for key, value in operation.items():
+        argv.append("--" + key.replace("_", "-"))
+        argv += [str(item) for item in value] if isinstance(value, list) else [str(value)]
+    return argv
+
+
+def batch(args):
+    parser = build_parser()
+    local = threading.local()
+
+    def session():
+        # One keep-alive session per worker thread, reused for all of its requests
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        return local.session
+
+    def run(line):
+        try:
+            operation = json.loads(line)
+            if operation.get("op") in BATCH_EXCLUDED:
+                return {"error": f"op '{operation['op']}' is not supported in batch mode"}
+            op_args = parser.parse_args(batch_argv(operation))
+        except (ValueError, KeyError, AttributeError, SystemExit):
+            return {"error": f"invalid operation: {line.strip()}"}
+        try:
+            return op_args.func(op_args, http=session())
+        except (requests.RequestException, ValueError) as e:
+            return {"error": str(e)}
+        except Exception as e:
+            # One bad line answers with an error instead of losing the results of the whole batch
+            return {"error": f"op '{op_args.command}' failed: {e!r}"}
+
+    # stdin isn't ours to close, a file we opened is
+    source = contextlib.nullcontext(sys.stdin) if args.file == "-" else open(args.file)
+    pending = deque()
+    with source as source, ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for line in source:
+            if not line.strip():
+                continue
+            pending.append(pool.submit(run, line))
+            # Bounded read-ahead; results come out in input order as the oldest one finishes
+            while len(pending) >= args.concurrency * 4:
+                print(json.dumps(pending.popleft().result()), flush=True)
+        while pending:
+            print(json.dumps(pending.popleft().result()), flush=True)
+
+
+class LatencyHistogram:
+    """HDR-style histogram: log-linear buckets with about 1.5% precision at any magnitude"""
+
+    SUB_BUCKETS = 64
+
+    def __init__(self):
+        self.counts = {}
+        self.total = 0
+        self.max = 0.0
+
+    def record(self, seconds):
+        micros = max(1.0, seconds * 1e6)
+        mantissa, exponent = math.frexp(micros)
+        # mantissa is in [0.5, 1), split each power of two into SUB_BUCKETS slices
+        key = exponent * self.SUB_BUCKETS + int((mantissa - 0.5) * 2 * self.SUB_BUCKETS)
+        self.counts[key] = self.counts.get(key, 0) + 1
+        self.total += 1
+        self.max = max(self.max, seconds)
+
+    def percentile(self, fraction):
+        # Upper edge of the bucket holding the requested rank, in seconds
+        rank = max(1, math.ceil(self.total * fraction))
+        seen = 0
+        for key in sorted(self.counts):
+            seen += self.counts[key]
+            if seen >= rank:
+                exponent, sub = divmod(key, self.SUB_BUCKETS)
+                return min(self.max, math.ldexp(0.5 + (sub + 1) / (2 * self.SUB_BUCKETS), exponent) / 1e6)
+        return 0.0
+
+
+def load_targets(token):
+    # Request per route name, given a session and the request number
+    return {
+        "root": lambda http, i: http.get(f"{BASE_URL}/"),
+        "hello": lambda http, i: http.get(f"{BASE_URL}/hello", params={"name": f"load{i}"}),
+        "sum": lambda http, i: http.get(f"{BASE_URL}/sum/{random.randint(0, 1000)}/{random.randint(0, 1000)}"),
+        "weather": lambda http, i: http.get(f"{BASE_URL}/weather", params={"city": random.choice(["Boston", "Paris", "Lima"])}),
+        "length": lambda http, i: http.get(f"{BASE_URL}/length/load{i}"),
+        "prime": lambda http, i: http.get(f"{BASE_URL}/prime/{random.randrange(10 ** 17, 10 ** 18)}"),
+        "register": lambda http, i: http.post(f"{BASE_URL}/register", json={"name": f"load-{time.time_ns()}-{i}", "pin": i}),
+        "login": lambda http, i: http.post(f"{BASE_URL}/login", json={"name": "caua", "pin": 28}),
+        "users": lambda http, i: http.get(f"{BASE_URL}/users-header", params={"limit": 100}, headers={"Authorization": f"Bearer {token}"}),
+    }
+
+
+def parse_mix(text):
+    # "root=5,prime=3" -> {"root": 5.0, "prime": 3.0}
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def load(args):
+    token = requests.post(f"{BASE_URL}/login", json={"name": "caua", "pin": 28}).json().get("token")
+    targets = load_targets(token)
+    mix = parse_mix(args.mix)
+    unknown = set(mix) - set(targets)
+    if unknown:
+        sys.exit(f"Unknown routes in --mix: {', '.join(sorted(unknown))} (choose from {', '.join(targets)})")
+    names = list(mix)
+    weights = [mix[name] for name in names]
+
+    histograms = {name: LatencyHistogram() for name in names}
+    errors = {name: 0 for name in names}
+    lock = threading.Lock()
+    local = threading.local()
+
+    def fire(name, i, intended):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        try:
+            ok = targets[name](local.session, i).status_code < 400
+        except requests.RequestException:
+            ok = False
+        # Measured from when the request was due, not when a thread got to it, so
+        # queueing behind a slow server counts against latency (no coordinated omission)
+        latency = time.perf_counter() - intended
+        with lock:
+            histograms[name].record(latency)
+            if not ok:
+                errors[name] += 1
+
+    total = int(args.rate * args.duration)
+    interval = 1.0 / args.rate
+    max_lag = 0.0
+    pool = ThreadPoolExecutor(max_workers=args.connections)
+    start = time.perf_counter()
+    for i in range(total):
+        intended = start + i * interval
+        delay = intended - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            max_lag = max(max_lag, -delay)
+        # Open loop: submit and move on, never wait for earlier responses
+        pool.submit(fire, random.choices(names, weights)[0], i, intended)
+    pool.shutdown(wait=True)
+    elapsed = time.perf_counter() - start
+
+    print(f"{'route':<10} {'requests':>9} {'errors':>7} {'p50 ms':>9} {'p99 ms':>9} {'p999 ms':>9} {'max ms':>9}")
+    overall = LatencyHistogram()
+    for name in names:
+        histogram = histograms[name]
+        for key, count in histogram.counts.items():
+            overall.counts[key] = overall.counts.get(key, 0) + count
+        overall.total += histogram.total
+        overall.max = max(overall.max, histogram.max)
+        if histogram.total:
+            print(f"{name:<10} {histogram.total:>9} {errors[name]:>7} {histogram.percentile(0.5) * 1e3:>9.2f} {histogram.percentile(0.99) * 1e3:>9.2f} {histogram.percentile(0.999) * 1e3:>9.2f} {histogram.max * 1e3:>9.2f}")
+    error_count = sum(errors.values())
+    print(f"{'all':<10} {overall.total:>9} {error_count:>7} {overall.percentile(0.5) * 1e3:>9.2f} {overall.percentile(0.99) * 1e3:>9.2f} {overall.percentile(0.999) * 1e3:>9.2f} {overall.max * 1e3:>9.2f}")
+    print(f"Target {args.rate:.0f} req/s, achieved {overall.total / elapsed:.0f} req/s over {elapsed:.1f}s, error rate {error_count / max(1, overall.total):.2%}")
+    if max_lag > interval:
+        print(f"Warning: the generator fell up to {max_lag * 1e3:.1f} ms behind schedule; lower --rate or run it on another machine")
+
+
+def build_parser():
     parser = argparse.ArgumentParser(description="CLI driver for FastAPI routes.")
     subparsers = parser.add_subparsers(dest="command", required=True)
 
@@ -89,11 +343,24 @@ def main():
     sp.add_argument("--two", type=int, required=True, help="Second integer")
     sp.set_defaults(func=sum_route)
 
+    # POST /sum (packed vectors)
+    sp = subparsers.add_parser("sum-vectors", help="POST /sum with packed vectors, added elementwise or reduced")
+    sp.add_argument("--vector", nargs="+", action="append", required=True, help="A vector; repeat for each one to add")
+    sp.add_argument("--dtype", choices=["int64", "float64"], default="int64", help="Element type (default=int64)")
+    sp.add_argument("--op", choices=["add", "sum", "min", "max", "mean"], default="add", help="Elementwise add, or a reduction of one vector (default=add)")
+    sp.set_defaults(func=sum_vectors)
+
     # GET /wiki/{topic}
     sp = subparsers.add_parser("wiki", help="GET /wiki/{topic} (redirect)")
     sp.add_argument("--topic", required=True, help="Wikipedia topic (use underscores)")
     sp.set_defaults(func=wiki)
 
+    # GET /wiki-suggest?prefix=<prefix>
+    sp = subparsers.add_parser("wiki-suggest", help="GET /wiki-suggest?prefix=<prefix> (title autocomplete)")
+    sp.add_argument("--prefix", required=True, help="Start of a Wikipedia title")
+    sp.add_argument("--limit", type=int, default=10, help="Titles to return (default=10)")
+    sp.set_defaults(func=wiki_suggest)
+
     # GET /weather?city=<city>
     sp = subparsers.add_parser("weather", help="GET /weather?city=<city>")
     sp.add_argument("--city", default="Boston", help="City name (default=Boston)")
@@ -104,11 +371,27 @@ def main():
     sp.add_argument("--text", required=True, help="Text to measure length")
     sp.set_defaults(func=length)
 
+    # POST /length (chunked body)
+    sp = subparsers.add_parser("length-file", help="POST /length with a file streamed as the body")
+    sp.add_argument("--file", default="-", help="File to measure, - for stdin (default=-)")
+    sp.set_defaults(func=length_file)
+
     # GET /prime/{number}
     sp = subparsers.add_parser("prime", help="GET /prime/{number}")
     sp.add_argument("--number", type=int, required=True, help="Number to check primality")
     sp.set_defaults(func=prime)
 
+    # POST /prime/batch
+    sp = subparsers.add_parser("prime-batch", help="POST /prime/batch")
+    sp.add_argument("--numbers", type=int, nargs="+", required=True, help="Numbers to check primality")
+    sp.set_defaults(func=prime_batch)
+
+    # GET /primes/{start}/{end}
+    sp = subparsers.add_parser("primes", help="GET /primes/{start}/{end} (streamed NDJSON)")
+    sp.add_argument("--start", type=int, required=True, help="Range start (inclusive)")
+    sp.add_argument("--end", type=int, required=True, help="Range end (inclusive)")
+    sp.set_defaults(func=prime_range)
+
     # POST /register
     sp = subparsers.add_parser("register", help="POST /register")
     sp.add_argument("--name", required=True, help="Username to create")
@@ -124,6 +407,8 @@ def main():
     # GET /users (cookie-based)
     sp = subparsers.add_parser("users", help="GET /users (cookie‐based)")
     sp.add_argument("--token", help="Auth token (sent as cookie named 'token')")
+    sp.add_argument("--after", type=int, default=0, help="Cursor from a previous page's 'next'")
+    sp.add_argument("--limit", type=int, help="Page size (default: 100, at most 1000)")
     sp.set_defaults(func=users_cookie)
 
     # GET /users-header (header-based)
@@ -131,10 +416,40 @@ def main():
         "users-header", help="GET /users-header (header‐based; use 'Bearer <token>')"
     )
     sp.add_argument("--token", required=True, help="Auth token (without 'Bearer ' prefix)")
+    sp.add_argument("--after", type=int, default=0, help="Cursor from a previous page's 'next'")
+    sp.add_argument("--limit", type=int, help="Page size (default: 100, at most 1000)")
     sp.set_defaults(func=users_header)
 
-    args = parser.parse_args()
-    args.func(args)
+    # GET /profiles and /profiles/collapsed
+    sp = subparsers.add_parser("profiles", help="GET /profiles, or /profiles/collapsed for flame graph input")
+    sp.add_argument("--token", required=True, help="Admin token (the server's PROFILE_TOKEN)")
+    sp.add_argument("--route", help="Only profiles of this route template, e.g. '/prime/{number}'")
+    sp.add_argument("--id", type=int, help="Only this profile (with --collapsed)")
+    sp.add_argument("--collapsed", action="store_true", help="Print merged stacks, one 'a;b;c microseconds' line each")
+    sp.set_defaults(func=profiles)
+
+    # Many operations, one JSON object per line, run concurrently
+    sp = subparsers.add_parser("batch", help='Run JSONL operations concurrently, e.g. {"op": "sum", "one": 1, "two": 2}')
+    sp.add_argument("--file", default="-", help="JSONL file of operations (default=stdin)")
+    sp.add_argument("--concurrency", type=int, default=8, help="Requests in flight at once (default=8)")
+    sp.set_defaults(func=batch)
+
+    # Open-loop load at a constant arrival rate
+    sp = subparsers.add_parser("load", help="Open-loop load: a weighted route mix at a constant arrival rate")
+    sp.add_argument("--rate", type=float, default=100, help="Requests per second to send (default=100)")
+    sp.add_argument("--duration", type=float, default=10, help="Seconds to run (default=10)")
+    sp.add_argument("--mix", default="root=4,hello=2,sum=2,weather=1,prime=2,login=1,users=1", help="Weighted routes, e.g. 'root=4,prime=2'")
+    sp.add_argument("--connections", type=int, default=64, help="Max requests in flight (default=64)")
+    sp.set_defaults(func=load)
+
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    result = args.func(args)
+    if result is not None:
+        print(result)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,75 @@
+import json
+import math
+
+from fastapi.responses import JSONResponse, Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _finite(content):
+    """content with every NaN or infinite float replaced by None, as orjson encodes them"""
+    if isinstance(content, float):
+        return content if math.isfinite(content) else None
+    if isinstance(content, dict):
+        return {key: _finite(value) for key, value in content.items()}
+    if isinstance(content, (list, tuple)):
+        return [_finite(value) for value in content]
+    return content
+
+
+def dumps(content):
+    """Compact UTF-8 JSON bytes, the same with or without orjson.
+
+    Matches what JSONResponse renders, except that NaN and infinite floats become
+    null where JSONResponse would raise.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(content)
+        except TypeError:
+            # orjson rejects ints wider than 64 bits; the stdlib encoder handles them
+            pass
+    try:
+        return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+    except ValueError:
+        return json.dumps(_finite(content), ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+
+
+class FastJSONResponse(JSONResponse):
+    """App-wide default response class, encodes with orjson when it is installed"""
+
+    def render(self, content):
+        return dumps(content)
+
+
+class RawJSONResponse(Response):
+    """A response whose JSON body is already encoded"""
+
+    media_type = "application/json"
+
+
+class JSONTemplate:
+    """A JSON object whose constant fields are encoded once, so each call only encodes the fields that vary"""
+
+    def __init__(self, **constants):
+        # '"description":"..."' without the surrounding braces
+        self.constants = dumps(constants)[1:-1]
+        self._keys = {}
+
+    def _key(self, name):
+        key = self._keys.get(name)
+        if key is None:
+            key = self._keys[name] = dumps(name) + b":"
+        return key
+
+    def encode(self, **fields):
+        parts = [self._key(name) + dumps(value) for name, value in fields.items()]
+        if self.constants:
+            parts.append(self.constants)
+        return b"{" + b",".join(parts) + b"}"
+
+    def render(self, **fields):
+        return RawJSONResponse(self.encode(**fields))
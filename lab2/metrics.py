@@ -0,0 +1,148 @@
+import bisect
+import time
+
+from starlette.routing import Match
+
+# Upper bounds in seconds, Prometheus' default latency buckets plus a sub-millisecond one
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Label for requests that matched no route, so unknown paths can't blow up cardinality
+UNMATCHED = "<unmatched>"
+# Methods labelled as themselves; any other method a client makes up is counted as "other"
+METHODS = frozenset(("GET", "HEAD", "POST", "PUT", "DELETE", "PATCH", "OPTIONS"))
+OTHER_METHOD = "other"
+
+
+class RouteStats:
+    __slots__ = ("in_flight", "buckets", "duration_sum", "count", "size_sum", "statuses")
+
+    def __init__(self):
+        self.in_flight = 0
+        # Non-cumulative counts, one per bucket plus +Inf; cumulated when rendered
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.duration_sum = 0.0
+        self.count = 0
+        self.size_sum = 0
+        # (method, status) -> requests
+        self.statuses = {}
+
+
+class Metrics:
+    """Per-route request metrics.
+
+    Only the event loop thread of a worker touches them, so plain integer
+    updates are enough and the hot path takes no locks.
+    """
+
+    def __init__(self):
+        self.routes = {}
+        # Functions returning (name, type, help, {labels: value}) for metrics kept elsewhere
+        self.collectors = []
+
+    def add_collector(self, collect):
+        self.collectors.append(collect)
+
+    def route(self, template):
+        stats = self.routes.get(template)
+        if stats is None:
+            stats = self.routes[template] = RouteStats()
+        return stats
+
+    def observe(self, stats, method, status, duration, size):
+        stats.buckets[bisect.bisect_left(LATENCY_BUCKETS, duration)] += 1
+        stats.duration_sum += duration
+        stats.count += 1
+        stats.size_sum += size
+        key = (method if method in METHODS else OTHER_METHOD, status)
+        stats.statuses[key] = stats.statuses.get(key, 0) + 1
+
+    def render(self):
+        """Prometheus text exposition format"""
+        lines = [
+            "# HELP http_requests_total Requests handled, by route template, method and status.",
+            "# TYPE http_requests_total counter",
+        ]
+        routes = sorted(self.routes.items())
+        for template, stats in routes:
+            for (method, status), count in sorted(stats.statuses.items()):
+                lines.append(f'http_requests_total{{route="{template}",method="{method}",status="{status}"}} {count}')
+
+        lines += [
+            "# HELP http_requests_in_flight Requests currently being handled.",
+            "# TYPE http_requests_in_flight gauge",
+        ]
+        for template, stats in routes:
+            lines.append(f'http_requests_in_flight{{route="{template}"}} {stats.in_flight}')
+
+        lines += [
+            "# HELP http_request_duration_seconds Time from request start to the last response byte.",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        for template, stats in routes:
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), stats.buckets):
+                cumulative += count
+                lines.append(f'http_request_duration_seconds_bucket{{route="{template}",le="{bound}"}} {cumulative}')
+            lines.append(f'http_request_duration_seconds_sum{{route="{template}"}} {stats.duration_sum}')
+            lines.append(f'http_request_duration_seconds_count{{route="{template}"}} {stats.count}')
+
+        lines += [
+            "# HELP http_response_size_bytes Response body bytes sent.",
+            "# TYPE http_response_size_bytes summary",
+        ]
+        for template, stats in routes:
+            lines.append(f'http_response_size_bytes_sum{{route="{template}"}} {stats.size_sum}')
+            lines.append(f'http_response_size_bytes_count{{route="{template}"}} {stats.count}')
+
+        for collect in self.collectors:
+            for name, kind, help, samples in collect():
+                lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+                for labels, value in samples.items():
+                    lines.append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def route_template(router, scope):
+    """The path template of the route that will handle scope, or UNMATCHED"""
+    # Same matching the router does next, done up front so the request can be labelled before it runs
+    for route in router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return UNMATCHED
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording Metrics for every HTTP request, labelled by route template"""
+
+    def __init__(self, app, metrics, router):
+        self.app = app
+        self.metrics = metrics
+        self.router = router
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # Kept in the scope so middleware further in can label or classify the request without matching again
+        template = scope["route_template"] = route_template(self.router, scope)
+        stats = self.metrics.route(template)
+        status = 500
+        size = 0
+
+        async def send_wrapper(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        stats.in_flight += 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            stats.in_flight -= 1
+            self.metrics.observe(stats, scope["method"], status, time.perf_counter() - start, size)
@@ -0,0 +1,138 @@
+import asyncio
+import hashlib
+import hmac
+import os
+import threading
+
+# scrypt cost: 2^14 rounds of 8-block mixing needs 16 MiB and ~50 ms of CPU per hash
+SCRYPT_N = 1 << 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+SALT_BYTES = 16
+WORKER_NICENESS = 10
+
+
+def hash_pin(pin, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P):
+    """A salted scrypt hash of pin, as "scrypt$n$r$p$salt$key" with hex salt and key"""
+    salt = os.urandom(SALT_BYTES)
+    key = hashlib.scrypt(str(pin).encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r + (1 << 20), dklen=32)
+    return f"scrypt${n}${r}${p}${salt.hex()}${key.hex()}"
+
+
+def verify_pin(pin, stored):
+    """Whether pin matches a hash from hash_pin; a plain integer from a log written before hashing is compared as is.
+
+    A stored value that isn't either, e.g. a corrupted log entry, matches nothing.
+    """
+    if isinstance(stored, int):
+        return hmac.compare_digest(str(stored).encode(), str(pin).encode())
+    try:
+        scheme, n, r, p, salt, key = stored.split("$")
+        if scheme != "scrypt":
+            return False
+        n, r, p = int(n), int(r), int(p)
+        computed = hashlib.scrypt(str(pin).encode(), salt=bytes.fromhex(salt), n=n, r=r, p=p, maxmem=256 * n * r + (1 << 20), dklen=32)
+        return hmac.compare_digest(computed, bytes.fromhex(key))
+    except (AttributeError, TypeError, ValueError):
+        return False
+
+
+class Overloaded(Exception):
+    """Too many PIN hashes are already running or queued"""
+
+
+class PinHasher:
+    """Hashes and checks PINs on a few worker threads, off the event loop.
+
+    scrypt releases the GIL, so the loop keeps serving while workers hash, and the
+    workers run at a lower priority so they yield the CPU to it. At most `workers`
+    hashes run at once and `queue_limit` more wait; past that, calls raise Overloaded
+    right away instead of queueing, so a login storm can't build an unbounded backlog.
+    Only the event loop thread calls hash and verify.
+    """
+
+    def __init__(self, workers=2, queue_limit=32, n=SCRYPT_N):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.n = n
+        self.pending = 0
+        self.shed = 0
+        self.completed = 0
+        self._pool = None
+        # Unknown users are checked against this, so a login costs the same whether or not the name exists
+        self._dummy = None
+
+    def _executor(self):
+        if self._pool is None:
+            from concurrent.futures import ThreadPoolExecutor
+
+            self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix="pin-hash", initializer=_lower_priority)
+        return self._pool
+
+    async def _run(self, func, *args):
+        if self.pending >= self.workers + self.queue_limit:
+            self.shed += 1
+            raise Overloaded(f"{self.pending} PIN hashes already running or queued")
+        loop = asyncio.get_running_loop()
+        job = self._executor().submit(func, *args)
+        self.pending += 1
+
+        def finished(job):
+            # Runs on the worker thread once the hash is really done (or was cancelled before it
+            # started), so a caller that gave up doesn't free a slot scrypt is still using
+            try:
+                loop.call_soon_threadsafe(self._finished, job)
+            except RuntimeError:
+                pass  # the loop is closed
+
+        job.add_done_callback(finished)
+        return await asyncio.wrap_future(job)
+
+    def _finished(self, job):
+        self.pending -= 1
+        if not job.cancelled():
+            self.completed += 1
+
+    async def hash(self, pin):
+        """A new hash of pin, raises Overloaded when the queue is full"""
+        return await self._run(hash_pin, pin, self.n)
+
+    async def verify(self, pin, stored):
+        """Whether pin matches stored (None for an unknown user), raises Overloaded when the queue is full"""
+        if stored is None:
+            if self._dummy is None:
+                self._dummy = await self._run(hash_pin, 0, self.n)
+            await self._run(verify_pin, pin, self._dummy)
+            return False
+        return await self._run(verify_pin, pin, stored)
+
+    def stats(self):
+        return {
+            "running": min(self.pending, self.workers),
+            "queued": max(self.pending - self.workers, 0),
+            "shed": self.shed,
+            "completed": self.completed,
+        }
+
+    def collect(self):
+        """Prometheus samples for Metrics.add_collector"""
+        stats = self.stats()
+        return [
+            ("pin_hash_running", "gauge", "PIN hashes running on worker threads.", {"": stats["running"]}),
+            ("pin_hash_queued", "gauge", "PIN hashes waiting for a worker thread.", {"": stats["queued"]}),
+            ("pin_hash_shed_total", "counter", "PIN hashes refused because the queue was full.", {"": stats["shed"]}),
+            ("pin_hash_completed_total", "counter", "PIN hashes finished.", {"": stats["completed"]}),
+        ]
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+def _lower_priority():
+    # Linux applies a thread id's niceness to that thread alone; elsewhere workers keep the process priority
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), WORKER_NICENESS)
+    except (AttributeError, OSError):
+        pass
@@ -0,0 +1,199 @@
+import math
+import random
+import time
+
+# numpy is imported inside the vectorized functions, so processes that only check single numbers never load it
+
+# Numbers below this are answered straight from a precomputed bitset
+SIEVE_LIMIT = 1 << 22
+
+# Miller-Rabin with these bases is exact for every 64-bit n (Sinclair's set)
+DETERMINISTIC_BASES = (2, 325, 9375, 28178, 450775, 9780504, 1795265022)
+DETERMINISTIC_LIMIT = 1 << 64
+
+# Below this Miller-Rabin runs vectorized in uint64 (products of two residues fit)
+VECTOR_LIMIT = 1 << 32
+VECTOR_BASES = (2, 7, 61)
+
+# Odd numbers sieved per segment when enumerating a range (fixed memory per segment)
+SEGMENT_SIZE = 1 << 18
+
+# Ranges are sieved with base primes from the bitset, so they must end below its square
+RANGE_LIMIT = SIEVE_LIMIT * SIEVE_LIMIT
+
+# Random bases used above the deterministic range (error < 4^-rounds)
+PROBABILISTIC_ROUNDS = 16
+
+SMALL_PRIMES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47)
+
+
+def _build_sieve(limit):
+    """Sieve of Eratosthenes over odd numbers, packed one bit per odd number"""
+    # flags[i] tells whether 2*i + 1 is prime
+    size = limit // 2
+    flags = bytearray(b"\x01") * size
+    flags[0] = 0
+    i = 1
+    while (2 * i + 1) ** 2 < limit:
+        if flags[i]:
+            p = 2 * i + 1
+            start = p * p // 2
+            flags[start::p] = bytes(len(range(start, size, p)))
+        i += 1
+    # Pack the byte flags into bits in C speed: little-endian bit i is flags[i]
+    packed = int(flags[::-1].translate(bytes.maketrans(b"\x00\x01", b"01")), 2)
+    return packed.to_bytes((size + 7) // 8, "little")
+
+
+_sieve = _build_sieve(SIEVE_LIMIT)
+
+
+def _sieve_lookup(n):
+    if n == 2:
+        return True
+    if n < 2 or n % 2 == 0:
+        return False
+    i = n >> 1
+    return bool(_sieve[i >> 3] >> (i & 7) & 1)
+
+
+def _miller_rabin(n, bases):
+    d = n - 1
+    s = 0
+    while d % 2 == 0:
+        d //= 2
+        s += 1
+    for a in bases:
+        a %= n
+        if a == 0:
+            continue
+        x = pow(a, d, n)
+        if x == 1 or x == n - 1:
+            continue
+        for _ in range(s - 1):
+            x = x * x % n
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+
+def check(n):
+    """Return (is_prime, method) where method names the strategy that answered"""
+    if n < SIEVE_LIMIT:
+        return _sieve_lookup(n), "sieve"
+    for p in SMALL_PRIMES:
+        if n % p == 0:
+            return False, "trial"
+    if n < DETERMINISTIC_LIMIT:
+        return _miller_rabin(n, DETERMINISTIC_BASES), "miller-rabin"
+    bases = [random.randrange(2, n - 1) for _ in range(PROBABILISTIC_ROUNDS)]
+    return _miller_rabin(n, bases), "probabilistic"
+
+
+def is_prime(n):
+    return check(n)[0]
+
+
+def timed_check(n):
+    """Same as check() plus the time spent in seconds"""
+    start = time.perf_counter()
+    result, method = check(n)
+    return result, method, time.perf_counter() - start
+
+
+def _vector_powmod(base, exp, mod):
+    import numpy as np
+    result = np.ones_like(mod)
+    base = base % mod
+    exp = exp.copy()
+    while exp.any():
+        odd = (exp & 1).astype(bool)
+        result = np.where(odd, result * base % mod, result)
+        base = base * base % mod
+        exp >>= 1
+    return result
+
+
+def _vector_miller_rabin(n):
+    import numpy as np
+    # n is a uint64 array of odd values in [SIEVE_LIMIT, VECTOR_LIMIT)
+    if n.size == 0:
+        return np.zeros(0, dtype=bool)
+    d = n - 1
+    s = np.zeros_like(n)
+    while True:
+        even = (d & 1) == 0
+        if not even.any():
+            break
+        d = np.where(even, d >> 1, d)
+        s += even
+    prime = np.ones(n.shape, dtype=bool)
+    minus_one = n - 1
+    for a in VECTOR_BASES:
+        x = _vector_powmod(np.full_like(n, a), d, n)
+        passed = (x == 1) | (x == minus_one)
+        for r in range(1, int(s.max())):
+            x = x * x % n
+            passed |= (x == minus_one) & (r < s)
+        prime &= passed
+    return prime
+
+
+def check_many(values):
+    """Vectorized is_prime over an int64 array, returns a bool array of the same shape"""
+    import numpy as np
+    values = np.asarray(values, dtype=np.int64)
+    result = np.zeros(values.shape, dtype=bool)
+
+    small = (values >= 0) & (values < SIEVE_LIMIT)
+    n = values[small]
+    index = n >> 1
+    bits = np.frombuffer(_sieve, dtype=np.uint8)[index >> 3] >> (index & 7).astype(np.uint8) & 1
+    result[small] = (bits.astype(bool) & (n % 2 == 1)) | (n == 2)
+
+    mid = (values >= SIEVE_LIMIT) & (values < VECTOR_LIMIT)
+    n = values[mid].astype(np.uint64)
+    candidate = np.ones(n.shape, dtype=bool)
+    for p in SMALL_PRIMES:
+        candidate &= n % np.uint64(p) != 0
+    mid_result = np.zeros(n.shape, dtype=bool)
+    mid_result[candidate] = _vector_miller_rabin(n[candidate])
+    result[mid] = mid_result
+
+    # Anything wider than 32 bits needs 128-bit products, so it goes one by one
+    for i in np.flatnonzero(values >= VECTOR_LIMIT):
+        result[i] = check(int(values[i]))[0]
+    return result
+
+
+def _base_primes(limit):
+    """Odd primes up to limit (inclusive), read off the bitset sieve"""
+    import numpy as np
+    bits = np.unpackbits(np.frombuffer(_sieve, dtype=np.uint8), bitorder="little")[: limit // 2 + 1]
+    return 2 * np.flatnonzero(bits).astype(np.int64) + 1
+
+
+def segments(start, end, segment_size=SEGMENT_SIZE):
+    """Yield int64 arrays with the primes in [start, end], one per sieved segment"""
+    import numpy as np
+    if end >= RANGE_LIMIT:
+        raise ValueError(f"end must be below {RANGE_LIMIT}")
+    if end < 2:
+        return
+    if start <= 2 <= end:
+        yield np.array([2], dtype=np.int64)
+    base = _base_primes(math.isqrt(end))
+    low = max(start, 3) | 1
+    while low <= end:
+        high = min(low + 2 * (segment_size - 1), end)
+        # flags[i] tells whether low + 2*i is prime
+        flags = np.ones((high - low) // 2 + 1, dtype=bool)
+        for p in base[: np.searchsorted(base, math.isqrt(high), side="right")].tolist():
+            first = max(p * p, -(-low // p) * p)
+            if first % 2 == 0:
+                first += p
+            flags[(first - low) // 2 :: p] = False
+        yield low + 2 * np.flatnonzero(flags)
+        low = high + 2
@@ -0,0 +1,232 @@
+import asyncio
+import collections
+import hmac
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+
+# Request header carrying the admin token: the request is profiled, and /profiles answers
+TOKEN_HEADER = b"x-profile-token"
+# Seconds of wall time between two stack samples
+SAMPLE_INTERVAL = 0.0001
+# Fraction of all other requests profiled at random
+SAMPLE_RATE = 0.001
+# Profiles kept, the oldest dropped first
+RING_SIZE = 256
+
+# Frame labels by code object, so a sample formats each function once
+_labels = {}
+_local = threading.local()
+
+
+def _label(code):
+    label = _labels.get(code)
+    if label is None:
+        label = _labels[code] = f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    return label
+
+
+class _Dispatcher:
+    """The sys.setprofile hook of one thread, handing a sample to the sampler of the running task.
+
+    Between samples an event costs a clock read. At a sample, the time since the last
+    one goes to the stack of the running task if it is being profiled; time spent idle or
+    in other tasks is dropped.
+    """
+
+    def __init__(self):
+        self.samplers = {}
+        self.last = time.perf_counter()
+
+    def __call__(self, frame, event, arg):
+        now = time.perf_counter()
+        elapsed = now - self.last
+        if elapsed < SAMPLE_INTERVAL:
+            return
+        self.last = now
+        sampler = self.samplers.get(asyncio.current_task())
+        if sampler is not None:
+            sampler.sample(frame, event, arg, elapsed)
+
+
+class StackSampler:
+    """Samples the stack of the current asyncio task every SAMPLE_INTERVAL, below the frame that started it.
+
+    It rides on sys.setprofile instead of a sampling thread: a thread only gets the GIL
+    every switch interval (5 ms), too coarse for requests of well under a millisecond,
+    and can't see C calls such as pydantic-core's validators. The hook runs on every
+    call in the thread while any task is sampled, so compare proportions rather than
+    absolute times. Work handed to other threads or processes isn't sampled.
+    """
+
+    def __init__(self):
+        # Seconds per collapsed stack, root first, frames joined by ";"
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self._root = None
+
+    def __enter__(self):
+        dispatcher = getattr(_local, "dispatcher", None)
+        if dispatcher is None:
+            dispatcher = _local.dispatcher = _Dispatcher()
+        if not dispatcher.samplers:
+            if sys.getprofile() is not None:
+                # Another profiler owns the hook; leave it alone and record nothing
+                return self
+            dispatcher.last = time.perf_counter()
+            sys.setprofile(dispatcher)
+        elif sys.getprofile() is not dispatcher:
+            return self
+        # The caller's frame; samples keep what runs below it
+        self._root = sys._getframe(1)
+        dispatcher.samplers[asyncio.current_task()] = self
+        return self
+
+    def __exit__(self, *exc):
+        if self._root is None:
+            return
+        dispatcher = _local.dispatcher
+        del dispatcher.samplers[asyncio.current_task()]
+        if not dispatcher.samplers:
+            sys.setprofile(None)
+        self._root = None
+
+    def sample(self, frame, event, arg, elapsed):
+        stack = []
+        if event == "call":
+            # The new frame hasn't run yet; the time was its caller's
+            frame = frame.f_back
+        if frame is None or frame.f_code in _SAMPLER_CODE:
+            # Starting or stopping the sampler itself
+            return
+        if event == "c_return" or event == "c_exception":
+            stack.append(f"{getattr(arg, '__qualname__', repr(arg))} (builtin)")
+        while frame is not None and frame is not self._root:
+            stack.append(_label(frame.f_code))
+            frame = frame.f_back
+        if frame is None or not stack:
+            return
+        stack.reverse()
+        self.stacks[";".join(stack)] += elapsed
+        self.samples += 1
+
+
+_SAMPLER_CODE = frozenset((StackSampler.__enter__.__code__, StackSampler.__exit__.__code__))
+
+
+class Profile:
+    __slots__ = ("id", "route", "method", "status", "trigger", "started", "duration", "samples", "stacks")
+
+    def summary(self):
+        return {
+            "id": self.id,
+            "route": self.route,
+            "method": self.method,
+            "status": self.status,
+            "trigger": self.trigger,
+            "started": self.started,
+            "duration_ms": round(self.duration * 1000, 3),
+            "samples": self.samples,
+        }
+
+
+def collapsed(profiles):
+    """Stacks of profiles merged in the collapsed format flamegraph.pl and speedscope read: "a;b;c microseconds" per line"""
+    total = collections.Counter()
+    for profile in profiles:
+        total.update(profile.stacks)
+    return "".join(f"{stack} {max(1, round(seconds * 1e6))}\n" for stack, seconds in sorted(total.items()))
+
+
+class Profiler:
+    """Profiles requests that present the admin token, and a random SAMPLE_RATE of the rest.
+
+    Finished profiles go into a ring buffer of the last `size`, read back through
+    find and collapsed. Only the event loop thread touches it.
+    """
+
+    def __init__(self, token, rate=SAMPLE_RATE, size=RING_SIZE):
+        self.token = token.encode() if isinstance(token, str) else token
+        self.rate = rate
+        self.profiles = collections.deque(maxlen=size)
+        self._ids = itertools.count(1)
+
+    def authorized(self, value):
+        """Whether value, a header value in bytes or str, is the admin token"""
+        if value is None:
+            return False
+        return hmac.compare_digest(value.encode() if isinstance(value, str) else value, self.token)
+
+    def find(self, route=None, id=None):
+        """Kept profiles, oldest first, optionally only those of a route template or with an id"""
+        return [
+            profile
+            for profile in self.profiles
+            if (route is None or profile.route == route) and (id is None or profile.id == id)
+        ]
+
+    def start(self, scope, trigger):
+        profile = Profile()
+        profile.id = next(self._ids)
+        profile.route = scope.get("route_template")
+        profile.method = scope["method"]
+        profile.status = 500
+        profile.trigger = trigger
+        profile.started = time.time()
+        return profile
+
+    def finish(self, profile, sampler, duration):
+        profile.duration = duration
+        profile.samples = sampler.samples
+        profile.stacks = sampler.stacks
+        self.profiles.append(profile)
+
+
+class ProfileMiddleware:
+    """ASGI middleware running the requests a Profiler picks under a StackSampler.
+
+    A request with the admin token in X-Profile-Token is always profiled and its
+    response says where to find the profile in X-Profile-Id. Routes in `exempt` are
+    never profiled. Place it innermost, so the profile covers the route alone.
+    """
+
+    def __init__(self, app, profiler, exempt=()):
+        self.app = app
+        self.profiler = profiler
+        self.exempt = frozenset(exempt)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("route_template") in self.exempt:
+            await self.app(scope, receive, send)
+            return
+        trigger = None
+        for name, value in scope["headers"]:
+            if name == TOKEN_HEADER:
+                if self.profiler.authorized(value):
+                    trigger = "header"
+                break
+        if trigger is None and random.random() < self.profiler.rate:
+            trigger = "random"
+        if trigger is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile = self.profiler.start(scope, trigger)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+                if trigger == "header":
+                    message = {**message, "headers": [*message.get("headers", ()), (b"x-profile-id", str(profile.id).encode())]}
+            await send(message)
+
+        start = time.perf_counter()
+        sampler = StackSampler()
+        try:
+            with sampler:
+                await self.app(scope, receive, send_wrapper)
+        finally:
+            self.profiler.finish(profile, sampler, time.perf_counter() - start)
@@ -0,0 +1,101 @@
+import functools
+import inspect
+import ipaddress
+import math
+import time
+from collections import OrderedDict
+
+from fastapi import HTTPException, Request
+
+
+class RateLimiter:
+    """Per-client token buckets: `rate` requests per second on average, bursts of up to `burst`.
+
+    Buckets are kept in least-recently-used order and capped at maxsize. A bucket
+    that has been idle long enough to refill is the same as a new one, so it is
+    dropped. Memory stays fixed however many clients show up. Only the event loop
+    thread touches the buckets, so they need no lock.
+
+    Clients are told apart by address. A request whose peer is one of
+    `trusted_proxies` (addresses or networks, e.g. the nginx in front) counts
+    against the client the proxy forwarded it for.
+    """
+
+    def __init__(self, rate, burst, maxsize=10000, trusted_proxies=()):
+        self.rate = rate
+        self.burst = burst
+        self.maxsize = maxsize
+        self.trusted_proxies = [ipaddress.ip_network(proxy, strict=False) for proxy in trusted_proxies]
+        self.limited = 0
+        # Seconds for an empty bucket to fill up again
+        self._refill = burst / rate
+        # client -> (tokens, updated_at), least recently used first
+        self._buckets = OrderedDict()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def stats(self):
+        return {"rate": self.rate, "burst": self.burst, "clients": len(self._buckets), "maxsize": self.maxsize, "limited": self.limited}
+
+    def acquire(self, client, now=None):
+        """Take a token from the client's bucket; returns 0 if there was one, else the seconds until there is"""
+        now = time.monotonic() if now is None else now
+        buckets = self._buckets
+        # Least recently used first, so expired buckets sit at the front
+        while buckets:
+            oldest = next(iter(buckets))
+            if now - buckets[oldest][1] < self._refill:
+                break
+            del buckets[oldest]
+
+        entry = buckets.pop(client, None)
+        tokens = self.burst if entry is None else min(self.burst, entry[0] + (now - entry[1]) * self.rate)
+        if tokens >= 1:
+            buckets[client] = (tokens - 1, now)
+            wait = 0
+        else:
+            buckets[client] = (tokens, now)
+            wait = (1 - tokens) / self.rate
+            self.limited += 1
+        if len(buckets) > self.maxsize:
+            # Under pressure the least recently seen client forgets its history and gets a full bucket back
+            buckets.popitem(last=False)
+        return wait
+
+    def client(self, request):
+        """The address a request's bucket is keyed on: the forwarded client's when the peer is a trusted proxy"""
+        host = request.client.host if request.client else ""
+        if not self.trusted_proxies or not self.trusted(host):
+            return host
+        # X-Real-IP is set by the proxy; X-Forwarded-For's last entry is the one the proxy appended,
+        # the earlier ones come from the client and can be forged
+        forwarded = request.headers.get("x-real-ip") or request.headers.get("x-forwarded-for", "").rpartition(",")[2].strip()
+        return forwarded or host
+
+    def trusted(self, host):
+        try:
+            address = ipaddress.ip_address(host)
+        except ValueError:
+            return False
+        return any(address in network for network in self.trusted_proxies)
+
+    def limit(self, func):
+        """Route decorator (placed under @app.post): answer 429 with Retry-After once the client's bucket is empty"""
+        signature = inspect.signature(func)
+        request_names = [name for name, p in signature.parameters.items() if p.annotation is Request]
+        request_name = request_names[0] if request_names else "_limit_request"
+        parameters = list(signature.parameters.values())
+        if not request_names:
+            parameters.append(inspect.Parameter(request_name, inspect.Parameter.KEYWORD_ONLY, annotation=Request))
+
+        @functools.wraps(func)
+        async def wrapper(**kwargs):
+            request = kwargs[request_name] if request_names else kwargs.pop(request_name)
+            wait = self.acquire(self.client(request))
+            if wait:
+                raise HTTPException(status_code=429, detail="Too many requests", headers={"Retry-After": str(math.ceil(wait))})
+            return await func(**kwargs)
+
+        wrapper.__signature__ = signature.replace(parameters=parameters)
+        return wrapper
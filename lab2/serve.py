@@ -0,0 +1,124 @@
+import argparse
+import atexit
+import os
+import secrets
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import uvicorn
+
+from store import UserStore
+
+# A worker exiting sooner than this after its fork most likely can't start at all, e.g. the app fails to import
+FAST_EXIT = 10.0
+# Seconds before respawning after a fast exit, doubling with each one in a row up to RESPAWN_DELAY_MAX
+RESPAWN_DELAY = 0.5
+RESPAWN_DELAY_MAX = 8.0
+# Fast exits in a row after which the launcher stops the workers and gives up
+MAX_FAST_EXITS = 5
+
+
+def shared_store_dir():
+    # tmpfs, so the user log every worker reads and appends lives in shared memory.
+    # It holds PIN hashes and is only good for this launch, so it goes when the launcher exits;
+    # workers leave through os._exit and never run the cleanup themselves
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else None
+    path = tempfile.mkdtemp(prefix="lab2-users-", dir=base)
+    atexit.register(shutil.rmtree, path, ignore_errors=True)
+    return path
+
+
+def run_worker(app, sock):
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    # Each worker imports the app itself, after the fork, and accepts on the shared socket
+    server = uvicorn.Server(uvicorn.Config(app, log_level="warning"))
+    server.run(sockets=[sock])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-forking launcher: N uvicorn workers sharing one socket and one user store.")
+    parser.add_argument("--app", default="main:app", help="ASGI app import string (default=main:app)")
+    parser.add_argument("--host", default="127.0.0.1", help="Bind address (default=127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8000, help="Bind port (default=8000)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes (default=CPU count)")
+    args = parser.parse_args()
+
+    # Workers must agree on the token secret and the user store, so settle both before forking
+    os.environ.setdefault("TOKEN_SECRET", secrets.token_hex(32))
+    if "USER_STORE_DIR" not in os.environ:
+        os.environ["USER_STORE_DIR"] = shared_store_dir()
+    # Nothing else has the store open yet, so the log can be folded into the snapshot
+    store = UserStore(os.environ["USER_STORE_DIR"])
+    store.compact()
+    store.close()
+
+    # Explicit IPPROTO_TCP: asyncio only sets TCP_NODELAY on accepted sockets when proto says TCP,
+    # and without it keep-alive responses stall on delayed ACKs
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    # pid -> monotonic time it was forked
+    workers = {}
+    stopping = False
+    wake = threading.Event()
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(args.app, sock)
+            finally:
+                os._exit(0)
+        workers[pid] = time.monotonic()
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        wake.set()
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    for _ in range(args.workers):
+        spawn()
+    print(f"Serving {args.app} on http://{args.host}:{args.port} with {args.workers} workers (users in {os.environ['USER_STORE_DIR']})")
+
+    fast_exits = 0
+    gave_up = False
+    while workers:
+        pid, _ = os.wait()
+        started = workers.pop(pid, None)
+        if stopping or started is None:
+            continue
+        # A worker died on its own; keep the pool at full size, but back off from one that dies on startup
+        if time.monotonic() - started >= FAST_EXIT:
+            fast_exits = 0
+            spawn()
+            continue
+        fast_exits += 1
+        if fast_exits >= MAX_FAST_EXITS:
+            print(f"Workers exited right after starting {fast_exits} times in a row, giving up", file=sys.stderr)
+            gave_up = True
+            stop(None, None)
+            continue
+        # Returns early when the launcher is told to stop
+        if not wake.wait(min(RESPAWN_DELAY * 2 ** (fast_exits - 1), RESPAWN_DELAY_MAX)):
+            spawn()
+    if gave_up:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+import contextlib
+import fcntl
+import itertools
+import json
+import os
+import threading
+
+LOG_NAME = "users.log"
+SNAPSHOT_NAME = "users.snapshot"
+
+
+class UserStore:
+    """Users indexed by name, persisted as an append-only log plus periodic snapshots.
+
+    With a directory the log is also how worker processes share users: writers
+    append under an exclusive file lock and every instance replays what others
+    appended before answering, so all workers see the same users.
+    """
+
+    def __init__(self, directory=None, snapshot_every=10000):
+        self.directory = directory
+        self.snapshot_every = snapshot_every
+        self._pins = {}
+        # Insertion order for listing; users are never removed, so it only grows
+        self._names = []
+        self._lock = threading.Lock()
+        self._fd = None
+        # Bytes and records of the log already applied to the index
+        self._offset = 0
+        self._records = 0
+        self._snapshot_thread = None
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self._load_snapshot()
+            self._fd = os.open(self._path(LOG_NAME), os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o600)
+            with self._lock, self._file_lock():
+                size = os.fstat(self._fd).st_size
+                if size < self._offset:
+                    # The log was compacted after this snapshot was taken; replay it all
+                    self._offset = self._records = 0
+                if size and os.pread(self._fd, 1, size - 1) != b"\n":
+                    # Terminate a record torn by a crash so the next append starts on a fresh line
+                    os.write(self._fd, b"\n")
+                self._apply_log()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        # Serializes appends across processes; self._lock does the same across threads
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _load_snapshot(self):
+        path = self._path(SNAPSHOT_NAME)
+        if not os.path.exists(path):
+            return
+        with open(path, encoding="utf-8") as f:
+            header = json.loads(f.readline())
+            for line in f:
+                record = json.loads(line)
+                self._insert(record["name"], record["pin"])
+        self._offset = header["log_offset"]
+        self._records = header["log_records"]
+
+    def _apply_log(self):
+        # Called with the lock held: replay complete records appended since the last call
+        size = os.fstat(self._fd).st_size
+        if size <= self._offset:
+            return
+        data = os.pread(self._fd, size - self._offset, self._offset)
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A record torn by a crash mid-write
+                continue
+            self._insert(record["name"], record["pin"])
+            self._records += 1
+        self._offset += end
+
+    def _catch_up(self):
+        if self._fd is not None and os.fstat(self._fd).st_size > self._offset:
+            with self._lock:
+                self._apply_log()
+
+    def _insert(self, name, pin):
+        if name in self._pins:
+            return False
+        self._pins[name] = pin
+        self._names.append(name)
+        return True
+
+    def add(self, name, pin):
+        """Create a user, returns False if the name is already taken"""
+        if self._fd is None:
+            with self._lock:
+                return self._insert(name, pin)
+        with self._lock, self._file_lock():
+            self._apply_log()
+            if name in self._pins:
+                return False
+            record = (json.dumps({"name": name, "pin": pin}) + "\n").encode()
+            os.write(self._fd, record)
+            self._offset += len(record)
+            self._records += 1
+            self._insert(name, pin)
+            # Record numbers are shared by all processes, so exactly one of them snapshots
+            if self._records % self.snapshot_every == 0:
+                self._start_snapshot()
+        return True
+
+    def authenticate(self, name, pin):
+        self._catch_up()
+        return self._pins.get(name) == pin
+
+    def credential(self, name):
+        """What was stored for name (a PIN hash, or a plain PIN in logs from before hashing), None if unknown"""
+        self._catch_up()
+        return self._pins.get(name)
+
+    def __contains__(self, name):
+        self._catch_up()
+        return name in self._pins
+
+    def __len__(self):
+        self._catch_up()
+        return len(self._names)
+
+    def names(self):
+        """The live, append-only list of names in registration order; callers must not modify it"""
+        self._catch_up()
+        return self._names
+
+    @property
+    def version(self):
+        """Changes whenever a user is added (users are never updated or removed)"""
+        return len(self)
+
+    def page(self, after=0, limit=None):
+        """Names after the first `after` ones, plus the cursor for the next page (None at the end)"""
+        self._catch_up()
+        count = len(self._names)
+        stop = count if limit is None else min(after + limit, count)
+        # Always a copy: a caller streaming the page must not see users added after it was taken
+        return self._names[after:stop], (stop if stop < count else None)
+
+    def _start_snapshot(self):
+        # Called with the lock held, so the index matches the log up to self._offset.
+        # The snapshot is written in the background from the stable list prefix.
+        if self._snapshot_thread is not None and self._snapshot_thread.is_alive():
+            return
+        args = (len(self._names), self._offset, self._records)
+        self._snapshot_thread = threading.Thread(target=self._write_snapshot, args=args, daemon=True)
+        self._snapshot_thread.start()
+
+    def _write_snapshot(self, count, log_offset, log_records):
+        tmp = self._path(f"{SNAPSHOT_NAME}.{os.getpid()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"log_offset": log_offset, "log_records": log_records}) + "\n")
+            for name in itertools.islice(self._names, count):
+                f.write(json.dumps({"name": name, "pin": self._pins[name]}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._path(SNAPSHOT_NAME))
+
+    def snapshot(self):
+        """Force a snapshot now and wait for it to finish"""
+        if self._fd is None:
+            return
+        if self._snapshot_thread is not None:
+            self._snapshot_thread.join()
+        with self._lock:
+            self._apply_log()
+            self._start_snapshot()
+            thread = self._snapshot_thread
+        thread.join()
+
+    def compact(self):
+        """Fold the whole log into the snapshot and empty the log.
+
+        Only safe while no other process has the store open (e.g. before forking workers).
+        """
+        if self._fd is None:
+            return
+        if self._snapshot_thread is not None:
+            self._snapshot_thread.join()
+        with self._lock, self._file_lock():
+            self._apply_log()
+            self._write_snapshot(len(self._names), 0, 0)
+            os.ftruncate(self._fd, 0)
+            self._offset = self._records = 0
+
+    def close(self):
+        if self._snapshot_thread is not None:
+            self._snapshot_thread.join()
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
@@ -1,40 +1,212 @@
+import argparse
+import asyncio
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from fastapi import FastAPI
+from fastapi.routing import APIRoute
 from fastapi.testclient import TestClient
+from starlette.concurrency import run_in_threadpool
+from starlette.routing import Match
+from unittest import mock
+import numpy as np
+import bench
+import fastjson
 import main
+import primes
+from accesslog import AccessLog
+from admission import AdmissionMiddleware, Gate, Rejected, offload
+from cache import ResponseCache
+from pins import Overloaded, PinHasher, hash_pin, verify_pin
+from profiling import StackSampler
+from ratelimit import RateLimiter
+from store import UserStore
+from tokens import TokenSigner
+import vectors
+import wikiindex
+from weather import HTTPWeatherProvider, UpstreamError, WeatherCache
+from weather_stub import start_stub
 
-client = TestClient(main.app)
+# Seconds a single call to each route may take through the TestClient, keyed like the bench cases.
+# Every route needs one; scale them all with TEST_BUDGET_SCALE on slow machines.
+LATENCY_BUDGETS = {
+    "GET /": 0.05,
+    "GET /hello": 0.05,
+    "GET /sum/{one}/{two}": 0.05,
+    # The first Arrow body imports pyarrow
+    "POST /sum": 0.25,
+    "GET /wiki/{topic:path}": 0.05,
+    "GET /wiki-suggest": 0.05,
+    "GET /weather": 0.05,
+    "GET /length/{text}": 0.05,
+    "POST /length": 0.25,
+    "GET /prime/{number}": 0.05,
+    "GET /cache-stats": 0.05,
+    "GET /metrics": 0.05,
+    "POST /prime/batch": 0.25,
+    "GET /primes/{start}/{end}": 0.5,
+    "POST /register": 0.05,
+    "POST /login": 0.05,
+    "GET /users": 0.1,
+    "GET /users-header": 0.1,
+    "GET /profiles": 0.05,
+    "GET /profiles/collapsed": 0.05,
+}
+BUDGET_SCALE = float(os.environ.get("TEST_BUDGET_SCALE", "1"))
+# scrypt cost for test apps: the cheapest there is, so route tests time the routes; TestPinHasher covers the real cost
+TEST_PIN_COST = 2
+
+
+class BudgetClient(TestClient):
+    """TestClient that fails any call taking longer than its route's latency budget.
+
+    The first client of an app makes untimed requests that load what the app builds
+    on first use (the user store, the seed user's hash and the title index), so no
+    route is charged for it.
+    """
+
+    def __init__(self, app, *args, **kwargs):
+        super().__init__(app, *args, **kwargs)
+        if not getattr(app.state, "budget_warm", False):
+            app.state.budget_warm = True
+            super().request("GET", "/users")
+            super().request("GET", "/wiki-suggest", params={"prefix": "a"})
+
+    def request(self, method, url, *args, **kwargs):
+        start = time.perf_counter()
+        resp = super().request(method, url, *args, **kwargs)
+        elapsed = time.perf_counter() - start
+        route = self.route_name(method, resp.request.url.path)
+        if route is not None:
+            budget = LATENCY_BUDGETS[route] * BUDGET_SCALE
+            if elapsed > budget:
+                raise AssertionError(f"{route} took {elapsed * 1000:.1f} ms, budget is {budget * 1000:.1f} ms")
+        return resp
+
+    def route_name(self, method, path):
+        scope = {"type": "http", "method": method, "path": path, "root_path": ""}
+        for route in self.app.routes:
+            if isinstance(route, APIRoute) and route.matches(scope)[0] == Match.FULL:
+                return f"{method} {route.path}"
+        return None
+
+
+def app_client():
+    # A fresh app per test: its own users, tokens, cache and metrics, so tests can run in any order or process
+    return BudgetClient(main.create_app(pin_hasher=PinHasher(n=TEST_PIN_COST), wiki_index=wikiindex.sample_index()))
 
 
 class TestAllRoutes(unittest.TestCase):
+    def setUp(self):
+        self.client = app_client()
+
     def test_root(self):
-        resp = client.get("/")
+        resp = self.client.get("/")
         self.assertEqual(resp.status_code, 200)
         data = resp.json()
         self.assertEqual(data["message"], "Hello World!")
         self.assertIn("description", data)
 
     def test_hello(self):
-        resp = client.get("/hello", params={"name": "Alice"})
+        resp = self.client.get("/hello", params={"name": "Alice"})
         self.assertEqual(resp.status_code, 200)
         data = resp.json()
         self.assertEqual(data["message"], "Hello Alice, how are you?")
         self.assertIn("description", data)
 
     def test_sum(self):
-        resp = client.get("/sum/3/5")
+        resp = self.client.get("/sum/3/5")
         self.assertEqual(resp.status_code, 200)
         data = resp.json()
         self.assertEqual(data["sum"], "8")
         self.assertIn("description", data)
 
+    def test_sum_vectors_packed(self):
+        a = np.arange(-500, 500, dtype="<i8")
+        b = a * 3
+        resp = self.client.post("/sum", content=a.tobytes() + b.tobytes(), headers={"Content-Type": "application/octet-stream"})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers["X-Count"], str(len(a)))
+        self.assertEqual(np.frombuffer(resp.content, dtype="<i8").tolist(), (a + b).tolist())
+
+        x = np.linspace(-1, 1, 301)
+        resp = self.client.post("/sum", params={"dtype": "float64", "count": 3}, content=np.concatenate([x, x, x]).tobytes())
+        self.assertTrue(np.allclose(np.frombuffer(resp.content, dtype="<f8"), 3 * x))
+        for op in vectors.REDUCTIONS:
+            data = self.client.post("/sum", params={"op": op, "dtype": "float64"}, content=x.tobytes()).json()
+            self.assertAlmostEqual(data["result"], getattr(np, op)(x))
+            self.assertEqual(data["count"], len(x))
+
+    def test_sum_vectors_rejects_non_finite_results(self):
+        big = np.array([1e308, 1e308], dtype="<f8")
+        for op in ("sum", "mean"):
+            resp = self.client.post("/sum", params={"op": op, "dtype": "float64"}, content=big.tobytes())
+            self.assertEqual(resp.status_code, 422)
+        nan = np.array([1.0, np.nan], dtype="<f8")
+        self.assertEqual(self.client.post("/sum", params={"op": "max", "dtype": "float64"}, content=nan.tobytes()).status_code, 422)
+        # Both encoders agree on values that can't be JSON numbers
+        for encoder in (fastjson.orjson, None):
+            with mock.patch.object(fastjson, "orjson", encoder):
+                self.assertEqual(fastjson.dumps({"x": [float("inf"), float("nan"), 1.5]}), b'{"x":[null,null,1.5]}')
+
+    def test_sum_vectors_rejects_bad_input(self):
+        self.assertEqual(self.client.post("/sum", content=b"x" * 24).status_code, 400)
+        self.assertEqual(self.client.post("/sum", params={"op": "min"}, content=b"").status_code, 400)
+        self.assertEqual(self.client.post("/sum", params={"op": "median"}, content=b"").status_code, 422)
+        self.assertEqual(self.client.post("/sum", content=b"x", headers={"Content-Type": vectors.ARROW_STREAM}).status_code, 400 if vectors.arrow_available() else 415)
+
+    @unittest.skipUnless(vectors.arrow_available(), "pyarrow is not installed")
+    def test_sum_vectors_arrow(self):
+        import pyarrow as pa
+        import pyarrow.ipc
+
+        table = pa.table({"a": np.arange(1000), "b": np.arange(1000) * 2, "c": np.ones(1000, dtype=np.int64)})
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        resp = self.client.post("/sum", content=sink.getvalue().to_pybytes(), headers={"Content-Type": vectors.ARROW_STREAM})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(pa.ipc.open_stream(resp.content).read_all().column("sum").to_pylist(), list(range(1, 3001, 3)))
+
     def test_wiki_redirect(self):
-        resp = client.get("/wiki/Python_(programming_language)", follow_redirects=False)
+        resp = self.client.get("/wiki/Python_(programming_language)", follow_redirects=False)
         self.assertIn(resp.status_code, (302, 307))
         location = resp.headers.get("location", "")
         self.assertTrue(location.startswith("https://en.wikipedia.org/wiki/"))
 
+    def test_wiki_canonicalizes_and_404s(self):
+        resp = self.client.get("/wiki/python (programming language)", follow_redirects=False)
+        self.assertEqual(resp.headers["location"], "https://en.wikipedia.org/wiki/Python_(programming_language)")
+        resp = self.client.get("/wiki/http/2", follow_redirects=False)
+        self.assertEqual(resp.headers["location"], "https://en.wikipedia.org/wiki/HTTP/2")
+        resp = self.client.get("/wiki/s%C3%A3o_paulo", follow_redirects=False)
+        self.assertEqual(resp.headers["location"], "https://en.wikipedia.org/wiki/S%C3%A3o_Paulo")
+        self.assertEqual(self.client.get("/wiki/No_such_article_anywhere", follow_redirects=False).status_code, 404)
+
+    def test_wiki_redirects_any_topic_without_an_index(self):
+        client = TestClient(main.create_app())
+        resp = client.get("/wiki/Docker_(software)", follow_redirects=False)
+        self.assertEqual(resp.status_code, 307)
+        self.assertEqual(resp.headers["location"], "https://en.wikipedia.org/wiki/Docker_(software)")
+        self.assertEqual(client.get("/wiki-suggest", params={"prefix": "doc"}).status_code, 404)
+
+    def test_wiki_suggest(self):
+        resp = self.client.get("/wiki-suggest", params={"prefix": "monty py"})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()["titles"], ["Monty_Python", "Monty_Python's_Flying_Circus"])
+        self.assertEqual(len(self.client.get("/wiki-suggest", params={"prefix": "b", "limit": 3}).json()["titles"]), 3)
+        self.assertEqual(self.client.get("/wiki-suggest", params={"prefix": "qqq"}).json()["titles"], [])
+
     def test_weather_default(self):
-        resp = client.get("/weather")
+        resp = self.client.get("/weather")
         self.assertEqual(resp.status_code, 200)
         data = resp.json()
         self.assertEqual(data["city"], "Boston")
@@ -42,44 +214,125 @@ class TestAllRoutes(unittest.TestCase):
         self.assertIn("description", data)
 
     def test_weather_custom(self):
-        resp = client.get("/weather", params={"city": "New York"})
+        resp = self.client.get("/weather", params={"city": "New York"})
         self.assertEqual(resp.status_code, 200)
         data = resp.json()
         self.assertEqual(data["city"], "New York")
 
     def test_length(self):
-        resp = client.get("/length/hello")
+        resp = self.client.get("/length/hello")
         self.assertEqual(resp.status_code, 200)
         data = resp.json()
         self.assertEqual(data["text"], "hello")
         self.assertEqual(data["length"], 5)
         self.assertIn("description", data)
 
+    def test_length_body_streamed(self):
+        text = "héllo wörld\n" * 1000 + "日本語 🎉 no newline at end"
+        data = text.encode()
+
+        def chunks():
+            # 7-byte chunks split multi-byte sequences at every possible offset
+            for i in range(0, len(data), 7):
+                yield data[i:i + 7]
+
+        resp = self.client.post("/length", content=chunks())
+        self.assertEqual(resp.status_code, 200)
+        body = resp.json()
+        self.assertEqual((body["bytes"], body["code_points"], body["lines"]), (len(data), len(text), 1001))
+        self.assertEqual(self.client.post("/length", content=b"").json()["lines"], 0)
+        self.assertEqual(self.client.post("/length", content=b"a\nb\n").json()["lines"], 2)
+        self.assertEqual(self.client.post("/length", content=b"\xff\xfe").status_code, 400)
+        self.assertEqual(self.client.post("/length", content="é".encode()[:1]).status_code, 400)
+
     def test_prime_true(self):
-        resp = client.get("/prime/17")
+        resp = self.client.get("/prime/17")
         self.assertEqual(resp.status_code, 200)
         data = resp.json()
         self.assertEqual(data["number"], 17)
         self.assertTrue(data["is_prime"])
 
     def test_prime_false(self):
-        resp = client.get("/prime/18")
+        resp = self.client.get("/prime/18")
         self.assertEqual(resp.status_code, 200)
         data = resp.json()
         self.assertEqual(data["number"], 18)
         self.assertFalse(data["is_prime"])
 
+    def test_prime_large(self):
+        resp = self.client.get("/prime/999999999999999989")
+        self.assertEqual(resp.status_code, 200)
+        data = resp.json()
+        self.assertTrue(data["is_prime"])
+        self.assertEqual(data["method"], "miller-rabin")
+        self.assertIn("Server-Timing", resp.headers)
+        # The engine time belongs to the request that did the work, not to the ones served from the cache
+        hit = self.client.get("/prime/999999999999999989")
+        self.assertEqual(hit.headers["X-Cache"], "HIT")
+        self.assertNotIn("Server-Timing", hit.headers)
+
+    def test_prime_batch_matches_single(self):
+        numbers = [-7, 0, 1, 2, 17, 18, 561, 7919, 4194301, 4194303, 3215031751, 4294967291, 999999999999999989]
+        resp = self.client.post("/prime/batch", json=numbers)
+        self.assertEqual(resp.status_code, 200)
+        data = resp.json()
+        self.assertEqual(data["count"], len(numbers))
+        expected = [self.client.get(f"/prime/{n}").json()["is_prime"] for n in numbers]
+        self.assertEqual(data["is_prime"], expected)
+
+    def test_prime_batch_binary(self):
+        numbers = np.arange(-100, 5000, dtype="<i8")
+        resp = self.client.post(
+            "/prime/batch",
+            content=numbers.tobytes(),
+            headers={"Content-Type": "application/octet-stream", "Accept": "application/octet-stream"},
+        )
+        self.assertEqual(resp.status_code, 200)
+        bitmap = np.unpackbits(np.frombuffer(resp.content, dtype=np.uint8), bitorder="little")[: len(numbers)]
+        self.assertEqual(bitmap.astype(bool).tolist(), [primes.is_prime(int(n)) for n in numbers])
+
+    def test_prime_batch_rejects_bad_input(self):
+        self.assertEqual(self.client.post("/prime/batch", json=[1, 2.5]).status_code, 400)
+        self.assertEqual(self.client.post("/prime/batch", json=[2 ** 70]).status_code, 400)
+        self.assertEqual(self.client.post("/prime/batch", content=b"1234567", headers={"Content-Type": "application/octet-stream"}).status_code, 400)
+
+    def test_prime_range_ndjson(self):
+        resp = self.client.get("/primes/90/200")
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.headers["content-type"].startswith("application/x-ndjson"))
+        numbers = [int(line) for line in resp.text.splitlines()]
+        self.assertEqual(numbers, [n for n in range(90, 201) if primes.is_prime(n)])
+
+    def test_prime_range_binary(self):
+        resp = self.client.get("/primes/0/100000", params={"format": "binary"})
+        self.assertEqual(resp.status_code, 200)
+        numbers = np.frombuffer(resp.content, dtype="<i8").tolist()
+        self.assertEqual(numbers, [n for n in range(0, 100001) if primes.is_prime(n)])
+
+    def test_prime_range_below_two_is_empty(self):
+        for start, end in ((-10, -5), (-3, 1), (0, 1), (1, 1)):
+            for format in ("ndjson", "binary"):
+                resp = self.client.get(f"/primes/{start}/{end}", params={"format": format})
+                self.assertEqual(resp.status_code, 200)
+                self.assertEqual(resp.content, b"", (start, end, format))
+        resp = self.client.get("/primes/-10/2", params={"format": "binary"})
+        self.assertEqual(np.frombuffer(resp.content, dtype="<i8").tolist(), [2])
+
+    def test_prime_range_rejects_bad_range(self):
+        self.assertEqual(self.client.get("/primes/10/5").status_code, 400)
+        self.assertEqual(self.client.get(f"/primes/0/{primes.RANGE_LIMIT}").status_code, 400)
+
     def test_register_and_login_and_list_users_cookie(self):
         new_name = "testuser"
         new_pin = 9999
-        resp_reg = client.post("/register", json={"name": new_name, "pin": new_pin})
+        resp_reg = self.client.post("/register", json={"name": new_name, "pin": new_pin})
         self.assertEqual(resp_reg.status_code, 200)
         data_reg = resp_reg.json()
         self.assertTrue(data_reg["success"])
         self.assertIn("description", data_reg)
 
         # Login with that user
-        resp_login = client.post("/login", json={"name": new_name, "pin": new_pin})
+        resp_login = self.client.post("/login", json={"name": new_name, "pin": new_pin})
         self.assertEqual(resp_login.status_code, 200)
         data_login = resp_login.json()
         self.assertTrue(data_login["success"])
@@ -87,36 +340,65 @@ class TestAllRoutes(unittest.TestCase):
         self.assertIsInstance(token, str)
 
         # List users without cookie → should return success=False
-        resp_no_cookie = client.get("/users")
+        resp_no_cookie = self.client.get("/users")
         self.assertEqual(resp_no_cookie.status_code, 200)
         data_no_cookie = resp_no_cookie.json()
         self.assertFalse(data_no_cookie["success"])
 
         # List users with cookie → should return the list
-        resp_users = client.get("/users", cookies={"token": token})
+        resp_users = self.client.get("/users", cookies={"token": token})
         self.assertEqual(resp_users.status_code, 200)
         data_users = resp_users.json()
         self.assertTrue(data_users["success"])
         self.assertIn(new_name, data_users["users"])
         self.assertIn("description", data_users)
 
+    def test_pins_are_stored_hashed(self):
+        self.client.post("/register", json={"name": "hashed", "pin": 4321})
+        users = self.client.app.state.users
+        self.assertTrue(users.credential("hashed").startswith("scrypt$"))
+        self.assertNotIn("4321", users.credential("hashed"))
+        self.assertFalse(self.client.post("/login", json={"name": "hashed", "pin": 1234}).json()["success"])
+        self.assertFalse(self.client.post("/login", json={"name": "nobody", "pin": 4321}).json()["success"])
+
+    def test_seed_user_is_hashed_once_on_the_pool(self):
+        app = main.create_app(pin_hasher=PinHasher(n=TEST_PIN_COST))
+        login = ("POST", "/login", b"", [("content-type", "application/json")], b'{"name": "caua", "pin": 28}')
+
+        async def first_logins():
+            return await asyncio.gather(*(bench.asgi_call(app, *login, client=bench.client_address(i)) for i in range(2)))
+
+        results = asyncio.run(first_logins())
+        self.assertTrue(all(json.loads(body)["success"] for _, _, body in results))
+        # Both requests waited for one store load: one seed hash plus two checks, all on the worker pool
+        self.assertEqual(app.state.pin_hasher.completed, 3)
+
+    def test_login_sheds_when_hashing_is_saturated(self):
+        hasher = self.client.app.state.pin_hasher
+        hasher.pending = hasher.workers + hasher.queue_limit
+        resp = self.client.post("/login", json={"name": "caua", "pin": 28})
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(resp.headers["Retry-After"], "1")
+        self.assertEqual(self.client.post("/register", json={"name": "late", "pin": 1}).status_code, 503)
+        self.assertIn("pin_hash_shed_total 2", self.client.get("/metrics").text)
+
     def test_list_users_header(self):
         # First, login as the built‐in user "caua" (pin 28) to get token
-        resp_login = client.post("/login", json={"name": "caua", "pin": 28})
+        resp_login = self.client.post("/login", json={"name": "caua", "pin": 28})
         self.assertEqual(resp_login.status_code, 200)
         data_login = resp_login.json()
         self.assertTrue(data_login["success"])
         token = data_login["token"]
 
         # Call /users-header with wrong token
-        resp_wrong = client.get("/users-header", headers={"Authorization": "Bearer wrongtoken"})
+        resp_wrong = self.client.get("/users-header", headers={"Authorization": "Bearer wrongtoken"})
         self.assertEqual(resp_wrong.status_code, 200)
         data_wrong = resp_wrong.json()
         self.assertFalse(data_wrong["success"])
         self.assertIsNone(data_wrong["users"])
 
         # Call /users-header with correct token
-        resp_ok = client.get("/users-header", headers={"Authorization": f"Bearer {token}"})
+        resp_ok = self.client.get("/users-header", headers={"Authorization": f"Bearer {token}"})
         self.assertEqual(resp_ok.status_code, 200)
         data_ok = resp_ok.json()
         self.assertTrue(data_ok["success"])
@@ -125,7 +407,7 @@ class TestAllRoutes(unittest.TestCase):
 
     def test_header_and_cookie_independence(self):
         # If both cookie and header present but header is wrong, must still fail
-        resp_both = client.get(
+        resp_both = self.client.get(
             "/users-header",
             cookies={"token": "invalid"},
             headers={"Authorization": "Bearer invalid"},
@@ -134,7 +416,796 @@ class TestAllRoutes(unittest.TestCase):
         data_both = resp_both.json()
         self.assertFalse(data_both["success"])
 
+    def test_list_users_pagination(self):
+        for i in range(5):
+            self.client.post("/register", json={"name": f"page{i}", "pin": i})
+        token = self.client.post("/login", json={"name": "caua", "pin": 28}).json()["token"]
+        everyone = self.client.get("/users", cookies={"token": token}).json()["users"]
+
+        collected, after = [], 0
+        while after is not None:
+            resp = self.client.get("/users-header", params={"after": after, "limit": 2}, headers={"Authorization": f"Bearer {token}"})
+            data = resp.json()
+            self.assertLessEqual(len(data["users"]), 2)
+            collected += data["users"]
+            after = data["next"]
+        self.assertEqual(collected, everyone)
+
+    def test_list_users_page_size_is_bounded(self):
+        token = self.client.post("/login", json={"name": "caua", "pin": 28}).json()["token"]
+        users = self.client.app.state.users
+        for i in range(main.USERS_PAGE_SIZE):
+            users.add(f"bulk{i}", "unused")
+        data = self.client.get("/users", cookies={"token": token}).json()
+        self.assertEqual(len(data["users"]), main.USERS_PAGE_SIZE)
+        self.assertEqual(data["next"], main.USERS_PAGE_SIZE)
+        resp = self.client.get("/users", params={"limit": main.USERS_PAGE_LIMIT + 1}, cookies={"token": token})
+        self.assertEqual(resp.status_code, 422)
+
+    def test_list_users_ndjson(self):
+        token = self.client.post("/login", json={"name": "caua", "pin": 28}).json()["token"]
+        everyone = self.client.get("/users", cookies={"token": token}).json()["users"]
+        resp = self.client.get("/users", params={"format": "ndjson"}, cookies={"token": token})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([json.loads(line) for line in resp.text.splitlines()], everyone)
+
+    def test_list_users_etag(self):
+        token = self.client.post("/login", json={"name": "caua", "pin": 28}).json()["token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        etag = self.client.get("/users-header", headers=headers).headers["ETag"]
+        resp = self.client.get("/users-header", headers={**headers, "If-None-Match": etag})
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.content, b"")
+
+        self.client.post("/register", json={"name": "etag-user", "pin": 1})
+        resp = self.client.get("/users-header", headers={**headers, "If-None-Match": etag})
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("etag-user", resp.json()["users"])
+
+    def test_apps_are_isolated(self):
+        self.client.post("/register", json={"name": "only-here", "pin": 1})
+        other = app_client()
+        self.assertEqual(other.post("/login", json={"name": "only-here", "pin": 1}).json(), {"success": False})
+        self.assertTrue(self.client.post("/login", json={"name": "only-here", "pin": 1}).json()["success"])
+
+    def test_every_route_has_a_latency_budget(self):
+        for route in self.client.app.routes:
+            if isinstance(route, APIRoute):
+                for method in route.methods:
+                    self.assertIn(f"{method} {route.path}", LATENCY_BUDGETS)
+
+    def test_budget_exceeded_fails(self):
+        slow = BudgetClient(FastAPI())
+
+        @slow.app.get("/")
+        async def root():
+            time.sleep(LATENCY_BUDGETS["GET /"] * BUDGET_SCALE + 0.01)
+            return {}
+
+        with self.assertRaisesRegex(AssertionError, "budget"):
+            slow.get("/")
+
+
+class TestStartup(unittest.TestCase):
+    def test_import_defers_rarely_used_pieces(self):
+        probe = "import sys, main; print(sorted(m for m in ('numpy', 'store', 'tokens') if m in sys.modules), 'app' in vars(main))"
+        out = subprocess.run([sys.executable, "-c", probe], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True).stdout
+        self.assertEqual(out.strip(), "[] False")
+
+    def test_parse_importtime(self):
+        report = "import time: self [us] | cumulative | imported package\nimport time:       120 |        300 |   json\nimport time:        40 |         40 |     json.decoder\n-- imported\nimport time:         9 |          9 | late\n"
+        self.assertEqual(bench.parse_importtime(report), {"json": 120, "json.decoder": 40})
+
+
+class TestBench(unittest.TestCase):
+    def test_every_route_has_a_benchmark_case(self):
+        cases = bench.route_cases(main.app)
+        for route in main.app.routes:
+            if isinstance(route, APIRoute):
+                for method in route.methods:
+                    self.assertIn(f"{method} {route.path}", cases)
+
+
+class TestResponseCache(unittest.TestCase):
+    def make_client(self, cache):
+        app = FastAPI()
+        self.calls = 0
+
+        @app.get("/double/{n}")
+        @cache.cached()
+        async def double(n: int):
+            self.calls += 1
+            return {"n": n * 2}
+
+        return TestClient(app)
+
+    def test_hit_skips_handler(self):
+        cache = ResponseCache()
+        cached_client = self.make_client(cache)
+        first = cached_client.get("/double/4")
+        second = cached_client.get("/double/4")
+        self.assertEqual(first.json(), {"n": 8})
+        self.assertEqual(second.content, first.content)
+        self.assertEqual((first.headers["X-Cache"], second.headers["X-Cache"]), ("MISS", "HIT"))
+        self.assertEqual(self.calls, 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertIn("max-age", second.headers["Cache-Control"])
+
+    def test_etag_not_modified(self):
+        cached_client = self.make_client(ResponseCache())
+        etag = cached_client.get("/double/4").headers["ETag"]
+        resp = cached_client.get("/double/4", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, 304)
+
+    def test_lru_eviction_and_ttl(self):
+        cache = ResponseCache(maxsize=2)
+        cached_client = self.make_client(cache)
+        for n in (1, 2, 1, 3, 1, 2):
+            cached_client.get(f"/double/{n}")
+        # 2 was evicted when 3 came in, 1 stayed hot
+        self.assertEqual(self.calls, 4)
+
+        expired_client = self.make_client(ResponseCache(ttl=0))
+        expired_client.get("/double/1")
+        expired_client.get("/double/1")
+        self.assertEqual(self.calls, 2)
+
+    def test_concurrent_misses_are_coalesced(self):
+        cache = ResponseCache()
+        app = FastAPI()
+        calls = []
+
+        @app.get("/slow/{n}")
+        @cache.cached()
+        async def slow(n: int):
+            calls.append(n)
+            await asyncio.sleep(0.05)
+            return {"n": n}
+
+        async def burst():
+            return await asyncio.gather(*[bench.asgi_call(app, "GET", f"/slow/{i % 2}") for i in range(10)])
+
+        results = asyncio.run(burst())
+        self.assertEqual(sorted(calls), [0, 1])
+        self.assertEqual((cache.misses, cache.coalesced), (2, 8))
+        self.assertEqual(sorted(dict(headers)[b"x-cache"] for _, headers, _ in results), [b"COALESCED"] * 8 + [b"MISS"] * 2)
+        self.assertEqual({body for _, _, body in results}, {b'{"n":0}', b'{"n":1}'})
+
+    def test_pure_routes_are_cached(self):
+        client = app_client()
+        client.get("/sum/40/2")
+        resp = client.get("/sum/40/2")
+        self.assertEqual(resp.headers["X-Cache"], "HIT")
+        self.assertEqual(resp.json()["sum"], "42")
+        stats = client.get("/cache-stats").json()
+        self.assertGreaterEqual(stats["hits"], 1)
+
+
+class TestMetrics(unittest.TestCase):
+    def test_metrics(self):
+        client = app_client()
+        client.get("/prime/7919")
+        client.get("/no/such/route")
+        resp = client.get("/metrics")
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.headers["content-type"].startswith("text/plain"))
+        text = resp.text
+        self.assertRegex(text, r'http_requests_total\{route="/prime/\{number\}",method="GET",status="200"\} [1-9]')
+        self.assertIn('http_requests_total{route="<unmatched>",method="GET",status="404"}', text)
+        self.assertIn('http_request_duration_seconds_bucket{route="/prime/{number}",le="+Inf"}', text)
+        self.assertIn('http_response_size_bytes_sum{route="/prime/{number}"}', text)
+        # The scrape itself is in flight while the page is rendered
+        self.assertIn('http_requests_in_flight{route="/metrics"} 1', text)
+
+    def test_unknown_methods_share_one_label(self):
+        client = app_client()
+        for method in ("FOO", "BAR"):
+            client.request(method, "/")
+        text = client.get("/metrics").text
+        self.assertIn('http_requests_total{route="<unmatched>",method="other",status="405"} 2', text)
+        self.assertNotIn('method="FOO"', text)
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_bucket_refills_at_rate(self):
+        limiter = RateLimiter(rate=2, burst=3)
+        self.assertEqual([limiter.acquire("a", now=0) for _ in range(4)], [0, 0, 0, 0.5])
+        self.assertEqual(limiter.acquire("b", now=0), 0)
+        self.assertEqual(limiter.acquire("a", now=0.5), 0)
+        self.assertEqual(limiter.limited, 1)
+
+    def test_memory_is_bounded(self):
+        limiter = RateLimiter(rate=1, burst=5, maxsize=100)
+        for i in range(1000):
+            limiter.acquire(f"client{i}", now=0)
+        self.assertEqual(len(limiter), 100)
+        # Buckets idle long enough to refill are dropped
+        limiter.acquire("late", now=5)
+        self.assertEqual(len(limiter), 1)
+
+    def test_routes_answer_429(self):
+        client = BudgetClient(main.create_app(rate_limits={"/login": (1, 2)}, pin_hasher=PinHasher(n=TEST_PIN_COST)))
+        other = BudgetClient(client.app, client=("10.0.0.2", 50000))
+        for _ in range(2):
+            self.assertTrue(client.post("/login", json={"name": "caua", "pin": 28}).json()["success"])
+        resp = client.post("/login", json={"name": "caua", "pin": 28})
+        self.assertEqual(resp.status_code, 429)
+        self.assertEqual(resp.headers["Retry-After"], "1")
+        # Buckets are per client and per route
+        self.assertEqual(other.post("/login", json={"name": "caua", "pin": 28}).status_code, 200)
+        self.assertEqual(client.post("/register", json={"name": "new", "pin": 1}).status_code, 200)
+
+    def test_clients_behind_a_trusted_proxy_get_their_own_buckets(self):
+        app = main.create_app(rate_limits={"/login": (1, 1)}, trusted_proxies=["10.0.0.0/24"], pin_hasher=PinHasher(n=TEST_PIN_COST))
+        proxy = BudgetClient(app, client=("10.0.0.5", 50000))
+        login = {"name": "caua", "pin": 28}
+        self.assertEqual(proxy.post("/login", json=login, headers={"X-Real-IP": "203.0.113.1"}).status_code, 200)
+        self.assertEqual(proxy.post("/login", json=login, headers={"X-Real-IP": "203.0.113.1"}).status_code, 429)
+        # Only the entry the proxy appended counts; the client's own X-Forwarded-For entries can be forged
+        self.assertEqual(proxy.post("/login", json=login, headers={"X-Forwarded-For": "203.0.113.1, 203.0.113.2"}).status_code, 200)
+        # An untrusted peer can't pick its bucket with the header
+        direct = BudgetClient(app, client=("198.51.100.7", 50000))
+        self.assertEqual(direct.post("/login", json=login, headers={"X-Real-IP": "203.0.113.3"}).status_code, 200)
+        self.assertEqual(direct.post("/login", json=login, headers={"X-Real-IP": "203.0.113.4"}).status_code, 429)
+
+
+class TestAdmission(unittest.TestCase):
+    def test_gate_queues_then_sheds(self):
+        gate = Gate(limit=1, queue_limit=1, deadline=5)
+
+        async def scenario():
+            deadline = asyncio.get_running_loop().time() + 5
+            await gate.acquire(deadline)
+            queued = asyncio.create_task(gate.acquire(deadline))
+            await asyncio.sleep(0)
+            with self.assertRaises(Rejected):
+                await gate.acquire(deadline)
+            self.assertEqual((gate.active, len(gate)), (1, 1))
+            # The finishing request hands its slot to the waiter
+            gate.release()
+            await queued
+            self.assertEqual((gate.active, len(gate)), (1, 0))
+            gate.release()
+
+        asyncio.run(scenario())
+        self.assertEqual(gate.stats(), {"active": 0, "queued": 0, "limit": 1, "queue_limit": 1, "admitted": 2, "shed": 1, "expired": 0, "timed_out": 0})
+
+    def test_queued_request_expires(self):
+        gate = Gate(limit=1, queue_limit=4, deadline=5)
+
+        async def scenario():
+            loop = asyncio.get_running_loop()
+            await gate.acquire(loop.time() + 5)
+            with self.assertRaises(Rejected):
+                await gate.acquire(loop.time() + 0.02)
+            gate.release()
+
+        asyncio.run(scenario())
+        self.assertEqual((gate.active, len(gate), gate.expired), (0, 0, 1))
+
+    def test_middleware_sheds_and_enforces_deadlines(self):
+        class SlowProvider:
+            async def fetch(self, city):
+                await asyncio.sleep(0.3)
+                return {"weather": "late"}
+
+            async def aclose(self):
+                pass
+
+        app = main.create_app(weather_provider=SlowProvider(), admission={"default": (1, 0, 0.1)})
+
+        async def burst():
+            first = asyncio.create_task(bench.asgi_call(app, "GET", "/weather", b"city=a"))
+            await asyncio.sleep(0.01)
+            second = await bench.asgi_call(app, "GET", "/weather", b"city=b")
+            return await first, second
+
+        (slow_status, _, _), (shed_status, shed_headers, _) = asyncio.run(burst())
+        self.assertEqual((slow_status, shed_status), (504, 503))
+        self.assertIn((b"retry-after", b"1"), shed_headers)
+        # A client can ask for less time than its class allows
+        status, _, _ = asyncio.run(bench.asgi_call(app, "GET", "/weather", b"city=c", headers=[("X-Request-Timeout", "0.01")]))
+        self.assertEqual(status, 504)
+        # /metrics skips admission, so it answers even with the class full
+        text = TestClient(app).get("/metrics").text
+        self.assertIn('admission_shed_total{class="default"} 1', text)
+        self.assertIn('admission_timed_out_total{class="default"} 2', text)
+
+    def test_offloaded_work_keeps_its_slot_past_the_deadline(self):
+        app = FastAPI()
+
+        @app.get("/work")
+        async def work():
+            await offload(run_in_threadpool(time.sleep, 0.3))
+            return {}
+
+        gate = Gate(limit=1, queue_limit=0, deadline=0.05)
+        app.add_middleware(AdmissionMiddleware, gates={"default": gate}, route_classes={}, router=app.router)
+
+        async def scenario():
+            status, _, _ = await bench.asgi_call(app, "GET", "/work")
+            # The 504 went out, but the thread is still sleeping, so the slot is still taken
+            shed, _, _ = await bench.asgi_call(app, "GET", "/work")
+            active = gate.active
+            await asyncio.sleep(0.4)
+            return status, shed, active
+
+        self.assertEqual(asyncio.run(scenario()), (504, 503, 1))
+        self.assertEqual(gate.active, 0)
+
+
+class TestProfiling(unittest.TestCase):
+    def test_sampler_records_stacks_below_its_frame(self):
+        def spin(seconds):
+            end = time.perf_counter() + seconds
+            while time.perf_counter() < end:
+                pass
+
+        async def handler():
+            with StackSampler() as sampler:
+                spin(0.02)
+            return sampler
+
+        sampler = asyncio.run(handler())
+        self.assertIsNone(sys.getprofile())
+        self.assertGreater(sampler.samples, 10)
+        stacks = list(sampler.stacks)
+        self.assertTrue(all(stack.startswith("TestProfiling.test_sampler_records_stacks_below_its_frame.<locals>.spin") for stack in stacks))
+        self.assertIn("perf_counter (builtin)", " ".join(stacks))
+
+    def test_token_requests_are_profiled(self):
+        client = BudgetClient(main.create_app(pin_hasher=PinHasher(n=TEST_PIN_COST), profile_token="admin", profile_rate=0))
+        token = {"X-Profile-Token": "admin"}
+        resp = client.post("/register", json={"name": "profiled", "pin": 1}, headers=token)
+        self.assertEqual(resp.status_code, 200)
+        profile_id = resp.headers["X-Profile-Id"]
+        self.assertNotIn("X-Profile-Id", client.get("/", headers={"X-Profile-Token": "guess"}).headers)
+
+        self.assertEqual(client.get("/profiles").status_code, 403)
+        profiles = client.get("/profiles", headers=token).json()["profiles"]
+        self.assertEqual([(p["id"], p["route"], p["status"], p["trigger"]) for p in profiles], [(int(profile_id), "/register", 200, "header")])
+        text = client.get("/profiles/collapsed", params={"id": profile_id}, headers=token).text
+        self.assertRegex(text, r"^(\S[^;\n]*)(;[^;\n]+)* \d+\n")
+        self.assertEqual(client.get("/profiles/collapsed", params={"id": 99}, headers=token).status_code, 404)
+
+    def test_random_profiles_skip_exempt_routes(self):
+        app = main.create_app(profile_token="admin", profile_rate=1.0)
+        client = TestClient(app)
+        for _ in range(3):
+            client.get("/")
+        client.get("/metrics")
+        self.assertEqual([(p.route, p.trigger) for p in app.state.profiler.find()], [("/", "random")] * 3)
+        # Without a token there is no profiling and no /profiles
+        self.assertEqual(TestClient(main.create_app()).get("/profiles").status_code, 404)
+
+
+class TestAccessLog(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "access.log")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_requests_are_logged_by_route_template(self):
+        log = AccessLog(self.path, flush_interval=0.01)
+        client = TestClient(main.create_app(access_log=log))
+        client.get("/prime/7919")
+        client.get("/no/such/route")
+        self.assertIn("access_log_dropped_total 0", client.get("/metrics").text)
+        log.close()
+        with open(self.path) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual([(r["method"], r["route"], r["status"]) for r in records], [("GET", "/prime/{number}", 200), ("GET", "<unmatched>", 404), ("GET", "/metrics", 200)])
+        self.assertGreater(records[0]["bytes"], 0)
+        self.assertGreaterEqual(records[0]["ms"], 0)
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        # The writer sleeps far longer than the test, so nothing leaves the queue until close
+        log = AccessLog(self.path, queue_limit=2, flush_interval=60)
+        for status in (200, 201, 202):
+            log.log("GET", "/", status, 0.001, 10)
+        self.assertEqual((len(log.records), log.dropped), (2, 1))
+        log.close()
+        with open(self.path) as f:
+            self.assertEqual([json.loads(line)["status"] for line in f], [200, 201])
+        self.assertEqual(log.written, 2)
+
+    def test_file_rotates_by_size(self):
+        log = AccessLog(self.path, batch_size=1, flush_interval=0.01, max_bytes=300, backups=2)
+        for i in range(12):
+            log.log("GET", "/", 200, 0.001, i)
+            time.sleep(0.02)
+        log.close()
+        self.assertGreaterEqual(log.rotations, 2)
+        # Only two backups are kept, each rotated as soon as it passed max_bytes
+        self.assertNotIn("access.log.3", os.listdir(self.dir.name))
+        for backup in (".1", ".2"):
+            self.assertLess(os.path.getsize(self.path + backup), 300 + 100)
+
+
+class TestWeather(unittest.TestCase):
+    def test_stale_while_revalidate(self):
+        class CountingProvider:
+            calls = 0
+
+            async def fetch(self, city):
+                self.calls += 1
+                await asyncio.sleep(0.01)
+                return {"weather": f"report{self.calls}"}
+
+        async def scenario():
+            cache = WeatherCache(CountingProvider(), ttl=0, stale_ttl=60)
+            first = await cache.get("Paris")
+            # Expired but within stale_ttl: answered at once, refreshed in the background, once
+            stale = [await cache.get("Paris") for _ in range(5)]
+            await asyncio.sleep(0.05)
+            return first, stale, await cache.get("Paris"), cache
+
+        first, stale, refreshed, cache = asyncio.run(scenario())
+        self.assertEqual(first, {"weather": "report1"})
+        self.assertEqual(stale, [{"weather": "report1"}] * 5)
+        self.assertEqual(refreshed, {"weather": "report2"})
+        self.assertEqual((cache.misses, cache.stale, cache.provider.calls), (1, 6, 3))
+
+    def test_upstream_requests_do_not_pile_up(self):
+        stub = start_stub(delay=0.2)
+        self.addCleanup(stub.stop)
+        app = main.create_app(weather_provider=HTTPWeatherProvider(stub.url))
+
+        async def burst():
+            return await asyncio.gather(*[bench.asgi_call(app, "GET", "/weather", b"city=Lisbon") for _ in range(20)])
+
+        results = asyncio.run(burst())
+        self.assertEqual({status for status, _, _ in results}, {200})
+        self.assertIn(json.loads(results[0][2])["weather"], ("sunny", "cloudy", "rainy", "windy", "snowy"))
+        self.assertEqual(stub.requests, 1)
+
+    def test_slow_upstream_times_out(self):
+        stub = start_stub(delay=0.5)
+        self.addCleanup(stub.stop)
+        app = main.create_app(weather_provider=HTTPWeatherProvider(stub.url, timeout=0.05))
+        status, headers, _ = asyncio.run(bench.asgi_call(app, "GET", "/weather", b"city=Oslo"))
+        self.assertEqual(status, 503)
+        self.assertIn((b"retry-after", b"5"), headers)
+        self.assertEqual(app.state.weather.errors, 1)
+
+
+class TestTitleIndex(unittest.TestCase):
+    def setUp(self):
+        titles = list(wikiindex.read_titles(wikiindex.SAMPLE_DUMP))
+        self.titles = titles
+        path = os.path.join(tempfile.mkdtemp(), "titles.idx")
+        self.assertEqual(wikiindex.build_index(titles + titles[:10], path), len(titles))
+        self.index = wikiindex.TitleIndex(path)
+        self.addCleanup(self.index.close)
+
+    def test_every_title_resolves_to_itself(self):
+        for title in self.titles:
+            self.assertEqual(self.index.lookup(title), title)
+            self.assertIn(self.index.lookup(title.upper()), self.titles)
+
+    def test_case_variants(self):
+        self.assertEqual(self.index.lookup("aids"), "AIDS")
+        self.assertEqual(self.index.lookup("Aids"), "Aids")
+        self.assertEqual(self.index.lookup("  new  york city "), "New_York_City")
+        self.assertIsNone(self.index.lookup("Pytho"))
+        self.assertIsNone(self.index.lookup(""))
+
+    def test_complete_matches_a_scan(self):
+        for prefix in ("p", "python_(", "BOSTON", "zü", "zz"):
+            expected = sorted((wikiindex.fold(t), t) for t in self.titles if wikiindex.fold(t).startswith(wikiindex.fold(prefix)))
+            self.assertEqual(self.index.complete(prefix, limit=1000), [t for _, t in expected])
+
+
+class TestVectors(unittest.TestCase):
+    def test_body_is_held_once(self):
+        import tracemalloc
+
+        payload = np.arange(1 << 20, dtype="<i8").tobytes()
+        chunks = [payload[i:i + 65536] for i in range(0, len(payload), 65536)]
+
+        class Upload:
+            headers = {"content-length": str(len(payload))}
+
+            async def stream(self):
+                for chunk in chunks:
+                    yield chunk
+
+        async def add():
+            # Measured inside the loop: asyncio.run itself briefly copies a large return value
+            tracemalloc.start()
+            try:
+                body = await vectors.read_body(Upload())
+                total = vectors.add(vectors.unpack(body, "int64", 2))
+                return body, total, tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        body, total, peak = asyncio.run(add())
+        self.assertLess(peak, 1.1 * len(payload))
+        self.assertTrue(np.shares_memory(total, np.frombuffer(body, dtype=np.uint8)))
+        self.assertEqual(bytes(vectors.pack(total)), (np.arange(1 << 19) * 2 + (1 << 19)).astype("<i8").tobytes())
+
+    def test_body_limit(self):
+        class Upload:
+            headers = {"content-length": "100"}
+
+        with self.assertRaises(vectors.BodyTooLarge):
+            asyncio.run(vectors.read_body(Upload(), limit=99))
+
+
+class TestPrimeEngine(unittest.TestCase):
+    def naive(self, n):
+        if n < 2:
+            return False
+        return all(n % i for i in range(2, int(n ** 0.5) + 1))
+
+    def test_matches_trial_division(self):
+        for n in list(range(-5, 5000)) + list(range(primes.SIEVE_LIMIT - 500, primes.SIEVE_LIMIT + 500)):
+            self.assertEqual(primes.is_prime(n), self.naive(n), n)
+
+    def test_strong_pseudoprimes(self):
+        # Composites that fool Miller-Rabin for small fixed base sets
+        for n in (3215031751, 2152302898747, 3474749660383, 341550071728321, 3825123056546413051):
+            self.assertFalse(primes.is_prime(n), n)
+
+    def test_check_many_matches_check(self):
+        numbers = np.concatenate([
+            np.arange(-10, 3000),
+            np.random.randint(primes.SIEVE_LIMIT, primes.VECTOR_LIMIT, 3000),
+            [3215031751, 4294967291, 4294967279, 2 ** 61 - 1, 2 ** 62],
+        ])
+        self.assertEqual(primes.check_many(numbers).tolist(), [primes.is_prime(int(n)) for n in numbers])
+
+    def test_segments_across_boundaries(self):
+        for start, end in ((0, 100), (-5, 2), (-10, -5), (3, 3), (4, 4), (0, 1), (10 ** 6, 10 ** 6 + 5000)):
+            found = [int(n) for segment in primes.segments(start, end, segment_size=7) for n in segment]
+            self.assertEqual(found, [n for n in range(start, end + 1) if primes.is_prime(n)], (start, end))
+
+    def test_probabilistic(self):
+        self.assertEqual(primes.check(2 ** 127 - 1), (True, "probabilistic"))
+        self.assertFalse(primes.is_prime((2 ** 61 - 1) * (2 ** 89 - 1)))
+
+
+class TestPrimePool(unittest.TestCase):
+    def test_big_primes_coalesce_in_worker_processes(self):
+        # Without admission control, which would queue the fifth request behind the compute limit
+        app = main.create_app(admission={})
+        number = 2 ** 127 - 1
+        # A pool left running keeps a -j worker process from exiting
+        self.addCleanup(app.state.prime_pool.close)
+
+        async def burst():
+            return await asyncio.gather(*[bench.asgi_call(app, "GET", f"/prime/{number}") for _ in range(5)])
+
+        results = asyncio.run(burst())
+        self.assertEqual({status for status, _, _ in results}, {200})
+        self.assertTrue(json.loads(results[0][2])["is_prime"])
+        self.assertEqual(app.state.response_cache.stats()["coalesced"], 4)
+
+    def test_crashed_prime_pool_is_replaced(self):
+        app = main.create_app(admission={})
+        self.addCleanup(app.state.prime_pool.close)
+        number = 2 ** 61 - 1 + 2 ** 64
+
+        async def check():
+            status, _, body = await bench.asgi_call(app, "GET", f"/prime/{number}")
+            return status, body
+
+        self.assertEqual(asyncio.run(check())[0], 200)
+        # A worker dying mid-task, as one killed for memory would
+        with self.assertRaises(BrokenProcessPool):
+            app.state.prime_pool._executor().submit(os._exit, 1).result(timeout=30)
+        number += 2
+        statuses = [asyncio.run(check())[0] for _ in range(2)]
+        self.assertEqual(statuses, [503, 200])
+
+
+class TestUserStore(unittest.TestCase):
+    def test_add_and_authenticate(self):
+        store = UserStore()
+        self.assertTrue(store.add("ana", 1234))
+        self.assertFalse(store.add("ana", 9999))
+        self.assertTrue(store.authenticate("ana", 1234))
+        self.assertFalse(store.authenticate("ana", 9999))
+        self.assertFalse(store.authenticate("bob", 1234))
+        self.assertEqual(store.names(), ["ana"])
+
+    def test_page(self):
+        store = UserStore()
+        for name in "abcde":
+            store.add(name, 0)
+        self.assertEqual(store.page(0, 2), (["a", "b"], 2))
+        self.assertEqual(store.page(4, 2), (["e"], None))
+        self.assertEqual(store.page(), (["a", "b", "c", "d", "e"], None))
+        self.assertEqual(store.page(9, 2), ([], None))
+        # A page is a snapshot, even one covering every user
+        everyone, _ = store.page()
+        store.add("f", 0)
+        self.assertEqual(everyone, ["a", "b", "c", "d", "e"])
+
+    def test_recovers_from_log_and_snapshot(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = UserStore(directory, snapshot_every=3)
+            for i in range(10):
+                store.add(f"user{i}", i)
+            store.snapshot()
+            store.add("late", 42)
+            store.close()
+            # Recovery only replays the log past what the snapshot covers
+            with open(os.path.join(directory, "users.snapshot")) as f:
+                self.assertEqual(json.loads(f.readline())["log_records"], 10)
+
+            reopened = UserStore(directory)
+            self.assertEqual(reopened.names(), [f"user{i}" for i in range(10)] + ["late"])
+            self.assertTrue(reopened.authenticate("user7", 7))
+            reopened.close()
+
+    def test_shared_between_instances(self):
+        # Two instances on one directory behave like two worker processes
+        with tempfile.TemporaryDirectory() as directory:
+            first, second = UserStore(directory), UserStore(directory)
+            self.assertTrue(first.add("ana", 1))
+            self.assertTrue(second.authenticate("ana", 1))
+            self.assertFalse(second.add("ana", 2))
+            self.assertTrue(second.add("bob", 2))
+            self.assertEqual(first.names(), ["ana", "bob"])
+            first.close()
+            second.close()
+
+    def test_compact_and_torn_record(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = UserStore(directory)
+            store.add("ana", 1)
+            store.compact()
+            store.close()
+            self.assertEqual(os.path.getsize(os.path.join(directory, "users.log")), 0)
+            with open(os.path.join(directory, "users.log"), "a") as f:
+                f.write('{"name": "bob", "pin": 2}\n{"name": "ca')
+
+            store = UserStore(directory)
+            store.add("dan", 4)
+            store.close()
+            self.assertEqual(UserStore(directory).names(), ["ana", "bob", "dan"])
+
+    def test_concurrent_adds(self):
+        store = UserStore()
+        threads = [threading.Thread(target=lambda: [store.add(f"user{i}", i) for i in range(2000)]) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(store), 2000)
+
+
+class TestPinHasher(unittest.TestCase):
+    def test_hash_and_verify(self):
+        stored = hash_pin(1234, n=16)
+        self.assertTrue(verify_pin(1234, stored))
+        self.assertFalse(verify_pin(4321, stored))
+        self.assertNotEqual(hash_pin(1234, n=16), stored)
+        # Plain PINs from logs written before hashing still work
+        self.assertTrue(verify_pin(28, 28))
+        self.assertFalse(verify_pin(29, 28))
+        # Unparseable hashes fail the login instead of raising
+        for stored in ("", "bcrypt$1$2$3$00$00", "scrypt$x$8$1$00$00", "scrypt$16$8$1$zz$00", None):
+            self.assertFalse(verify_pin(1234, stored))
+
+    def test_queue_is_bounded(self):
+        hasher = PinHasher(workers=1, queue_limit=1)
+
+        async def storm():
+            return await asyncio.gather(*[hasher.hash(i) for i in range(5)], return_exceptions=True)
+
+        try:
+            results = asyncio.run(storm())
+        finally:
+            hasher.close()
+        self.assertEqual(sum(isinstance(result, Overloaded) for result in results), 3)
+        self.assertTrue(all(verify_pin(i, result) for i, result in enumerate(results[:2])))
+        self.assertEqual(hasher.stats(), {"running": 0, "queued": 0, "shed": 3, "completed": 2})
+
+    def test_cancelled_callers_keep_their_slot_until_the_hash_ends(self):
+        hasher = PinHasher(workers=1, queue_limit=0)
+
+        async def disconnect():
+            running = asyncio.ensure_future(hasher._run(time.sleep, 0.2))
+            await asyncio.sleep(0.05)
+            running.cancel()
+            await asyncio.sleep(0)
+            # The worker is still busy, so the next hash is shed rather than queued behind it
+            with self.assertRaises(Overloaded):
+                await hasher.hash(1)
+            await asyncio.sleep(0.3)
+            return await hasher.hash(1)
+
+        try:
+            self.assertTrue(verify_pin(1, asyncio.run(disconnect())))
+        finally:
+            hasher.close()
+        self.assertEqual(hasher.pending, 0)
+
+
+class TestTokenSigner(unittest.TestCase):
+    def test_issue_and_verify(self):
+        signer = TokenSigner(b"secret")
+        token = signer.issue("ana")
+        self.assertEqual(signer.verify(token), "ana")
+        # Second call is served from the cache
+        self.assertEqual(signer.verify(token), "ana")
+        self.assertEqual(signer.cache_info().hits, 1)
+
+    def test_rejects_tampered_and_foreign_tokens(self):
+        signer = TokenSigner(b"secret")
+        token = signer.issue("ana")
+        self.assertIsNone(signer.verify(token[:-2] + "xx"))
+        self.assertIsNone(signer.verify("not-a-token"))
+        self.assertIsNone(signer.verify(None))
+        self.assertIsNone(TokenSigner(b"other").verify(token))
+
+    def test_invalid_tokens_are_not_cached(self):
+        signer = TokenSigner(b"secret", cache_size=2)
+        token = signer.issue("ana")
+        signer.verify(token)
+        for i in range(10):
+            self.assertIsNone(signer.verify(f"garbage{i}"))
+        self.assertEqual(signer.cache_info().currsize, 1)
+        self.assertEqual(signer.verify(token), "ana")
+        self.assertEqual(signer.cache_info().hits, 1)
+
+    def test_expired_token_rejected_even_when_cached(self):
+        for signer in (TokenSigner(b"secret"), TokenSigner(b"secret", cache_size=0)):
+            token = signer.issue("ana", ttl=0)
+            self.assertIsNone(signer.verify(token))
+            self.assertIsNone(signer.verify(token))
+
+
+def warm_up():
+    # The first request in a process pays one-off setup in the test client, which no route should be charged for
+    TestClient(main.create_app()).get("/")
+
+
+def run_chunk(names):
+    result = unittest.TextTestRunner(stream=io.StringIO(), verbosity=0).run(unittest.defaultTestLoader.loadTestsFromNames(names))
+    failures = [(str(test), trace) for test, trace in result.failures + result.errors]
+    return result.testsRun, failures
+
+
+def test_names(suite):
+    for test in suite:
+        if isinstance(test, unittest.TestSuite):
+            yield from test_names(test)
+        else:
+            yield test.id()
+
+
+def run_parallel(jobs):
+    # Tests share no state, so they are dealt round-robin to worker processes
+    names = list(test_names(unittest.defaultTestLoader.loadTestsFromModule(sys.modules[__name__])))
+    names = [name.replace("__main__.", __name__ + ".", 1) for name in names]
+    chunks = [names[i::jobs] for i in range(jobs)]
+    # With more jobs than CPUs each test gets a share of a CPU, so the budgets stretch to match;
+    # the workers read the scale when they import this module to run their chunk
+    os.environ["TEST_BUDGET_SCALE"] = str(BUDGET_SCALE * max(1.0, jobs / (os.cpu_count() or 1)))
+    start = time.perf_counter()
+    with ProcessPoolExecutor(jobs, initializer=warm_up) as pool:
+        results = list(pool.map(run_chunk, chunks))
+    run = sum(count for count, _ in results)
+    failures = [failure for _, chunk in results for failure in chunk]
+    for test, trace in failures:
+        print("=" * 70 + f"\nFAIL: {test}\n" + "-" * 70 + f"\n{trace}")
+    print(f"Ran {run} tests in {time.perf_counter() - start:.3f}s across {jobs} processes\n")
+    print(f"FAILED (failures={len(failures)})" if failures else "OK")
+    return not failures
+
 
 if __name__ == "__main__":
-    unittest.main()
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("-j", "--jobs", type=int, default=1)
+    args, rest = parser.parse_known_args()
+    if args.jobs > 1:
+        sys.exit(0 if run_parallel(args.jobs) else 1)
+    warm_up()
+    unittest.main(argv=sys.argv[:1] + rest)
 
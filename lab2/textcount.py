@@ -0,0 +1,33 @@
+import codecs
+
+
+class TextCounter:
+    """Byte, code point and line counts of UTF-8 text fed in chunks of any size.
+
+    Only the current chunk is held: a multi-byte sequence split across chunks
+    is carried over by the incremental decoder, and lines are counted from the
+    newlines seen plus whether the last byte ended one.
+    """
+
+    def __init__(self):
+        self.bytes = 0
+        self.code_points = 0
+        self.newlines = 0
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._ends_line = True
+
+    def feed(self, chunk):
+        """Count one chunk, raises UnicodeDecodeError on invalid UTF-8"""
+        if not chunk:
+            return
+        self.code_points += len(self._decoder.decode(chunk))
+        self.bytes += len(chunk)
+        self.newlines += chunk.count(b"\n")
+        self._ends_line = chunk.endswith(b"\n")
+
+    def finish(self):
+        """Counts as a dict, raises UnicodeDecodeError if the text stopped mid-sequence"""
+        self.code_points += len(self._decoder.decode(b"", final=True))
+        # Like str.split("\n") without the empty piece after a final newline
+        lines = self.newlines + (0 if self._ends_line else 1)
+        return {"bytes": self.bytes, "code_points": self.code_points, "lines": lines}
@@ -0,0 +1,91 @@
+import base64
+import hashlib
+import hmac
+import json
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+# Every token shares this header, so it is encoded once
+HEADER = base64.urlsafe_b64encode(b'{"alg":"HS256","typ":"JWT"}').rstrip(b"=")
+
+# The shape of functools.lru_cache's cache_info()
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(data + b"=" * (-len(data) % 4))
+
+
+class TokenSigner:
+    """Issues and verifies HS256 JWTs, remembering recently verified tokens in an LRU cache"""
+
+    def __init__(self, secret, ttl=3600, cache_size=4096):
+        self.secret = secret
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        # token -> (name, exp) of tokens with a valid signature; expiry is still checked on every call.
+        # Invalid tokens are never stored, so a client sending garbage can't evict real sessions.
+        self._claims = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _sign(self, message):
+        return _b64encode(hmac.new(self.secret, message, hashlib.sha256).digest())
+
+    def issue(self, name, ttl=None):
+        now = int(time.time())
+        claims = {"sub": name, "iat": now, "exp": now + (self.ttl if ttl is None else ttl)}
+        message = HEADER + b"." + _b64encode(json.dumps(claims, separators=(",", ":")).encode())
+        return (message + b"." + self._sign(message)).decode()
+
+    def _verify_signature(self, token):
+        try:
+            message, signature = token.encode().rsplit(b".", 1)
+            header, payload = message.split(b".")
+        except ValueError:
+            return None
+        if header != HEADER or not hmac.compare_digest(signature, self._sign(message)):
+            return None
+        try:
+            claims = json.loads(_b64decode(payload))
+            return claims["sub"], claims["exp"]
+        except (ValueError, KeyError, TypeError):
+            return None
+
+    def verify(self, token):
+        """Return the user name the token was issued to, or None if it is invalid or expired"""
+        if not token:
+            return None
+        claims = self._cached_claims(token)
+        if claims is None or claims[1] <= time.time():
+            return None
+        return claims[0]
+
+    def _cached_claims(self, token):
+        if not self.cache_size:
+            return self._verify_signature(token)
+        with self._lock:
+            claims = self._claims.get(token)
+            if claims is not None:
+                self._claims.move_to_end(token)
+                self.hits += 1
+                return claims
+            self.misses += 1
+        claims = self._verify_signature(token)
+        if claims is not None:
+            with self._lock:
+                self._claims[token] = claims
+                while len(self._claims) > self.cache_size:
+                    self._claims.popitem(last=False)
+        return claims
+
+    def cache_info(self):
+        if not self.cache_size:
+            return None
+        return CacheInfo(self.hits, self.misses, self.cache_size, len(self._claims))
@@ -0,0 +1,144 @@
+import math
+
+# numpy, and pyarrow for Arrow bodies, are imported inside the functions, so importing this module costs nothing
+DTYPES = {"int64": "<i8", "float64": "<f8"}
+REDUCTIONS = ("sum", "min", "max", "mean")
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+# Largest body read into memory
+MAX_BODY = 256 << 20
+# Results are sent in slices this big, so the server copies one slice at a time instead of the whole result
+RESPONSE_CHUNK = 1 << 20
+
+
+def arrow_available():
+    """Whether pyarrow is installed, without importing it"""
+    import importlib.util
+
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+class VectorError(ValueError):
+    """The body doesn't hold the vectors the request asked for"""
+
+
+class BodyTooLarge(VectorError):
+    """The body is over MAX_BODY"""
+
+
+class NotFinite(VectorError):
+    """A float reduction came out infinite or NaN, which JSON can't carry"""
+
+
+async def read_body(request, limit=MAX_BODY):
+    """The whole body in one writable bytearray, each chunk copied in once.
+
+    With a Content-Length the buffer is allocated up front; a chunked body grows
+    it in place. Either way the body is held once, never as chunks plus a joined copy.
+    """
+    length = request.headers.get("content-length", "")
+    if not length.isdigit():
+        body = bytearray()
+        async for chunk in request.stream():
+            body += chunk
+            if len(body) > limit:
+                raise BodyTooLarge(f"Body is over {limit} bytes")
+        return body
+
+    size = int(length)
+    if size > limit:
+        raise BodyTooLarge(f"Body is over {limit} bytes")
+    body = bytearray(size)
+    position = 0
+    with memoryview(body) as view:
+        async for chunk in request.stream():
+            end = position + len(chunk)
+            if end > size:
+                raise VectorError("Body is longer than its Content-Length")
+            view[position:end] = chunk
+            position = end
+    if position != size:
+        raise VectorError("Body is shorter than its Content-Length")
+    return body
+
+
+def unpack(body, dtype, count):
+    """count equal-length vectors of packed little-endian dtype values, as views into body"""
+    import numpy as np
+
+    if len(body) % (8 * count):
+        raise VectorError(f"Body must be {count} packed little-endian {dtype} vector(s) of equal length")
+    return list(np.frombuffer(body, dtype=DTYPES[dtype]).reshape(count, -1))
+
+
+def unpack_arrow(body):
+    """The dtype name and columns of an Arrow IPC stream, as numpy views into body where the layout allows"""
+    import pyarrow as pa
+    import pyarrow.ipc
+
+    try:
+        table = pa.ipc.open_stream(pa.py_buffer(body)).read_all()
+    except pa.ArrowException as exc:
+        raise VectorError(f"Body is not an Arrow IPC stream: {exc}") from exc
+    types = {str(column.type) for column in table.columns}
+    if len(types) != 1 or not types <= DTYPES.keys():
+        raise VectorError("Arrow columns must all be int64 or all be float64")
+
+    columns = []
+    for column in table.columns:
+        if column.null_count:
+            raise VectorError("Arrow columns must not have nulls")
+        # A column split across record batches has to be joined, which copies it
+        array = column.chunk(0) if column.num_chunks == 1 else column.combine_chunks()
+        columns.append(array.to_numpy(zero_copy_only=True))
+    return types.pop(), columns
+
+
+def add(vectors):
+    """Elementwise sum of equal-length vectors, accumulated in place into the first one when it is writable"""
+    import numpy as np
+
+    first, *rest = vectors
+    if any(len(vector) != len(first) for vector in rest):
+        raise VectorError("Vectors must have equal length")
+    total = np.add(first, rest[0], out=first if first.flags.writeable else None)
+    for vector in rest[1:]:
+        np.add(total, vector, out=total)
+    return total
+
+
+def reduce(op, vector):
+    """One of REDUCTIONS over vector, as a Python number; int64 sums wrap around like numpy's"""
+    import numpy as np
+
+    if op != "sum" and len(vector) == 0:
+        raise VectorError(f"Can't take the {op} of an empty vector")
+    with np.errstate(over="ignore", invalid="ignore"):
+        result = getattr(np, op)(vector).item()
+    if isinstance(result, float) and not math.isfinite(result):
+        raise NotFinite(f"The {op} is {result}: the vector overflows float64 or holds NaN or infinity")
+    return result
+
+
+def pack(vector):
+    """vector's bytes as a memoryview, without copying"""
+    import numpy as np
+
+    return np.ascontiguousarray(vector).view(np.uint8).data
+
+
+async def slices(data, size=RESPONSE_CHUNK):
+    """data in memoryview slices of at most size bytes"""
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+def pack_arrow(vector, name="sum"):
+    """vector as an Arrow IPC stream with a single column"""
+    import pyarrow as pa
+    import pyarrow.ipc
+
+    batch = pa.record_batch([pa.array(vector)], names=[name])
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, batch.schema) as writer:
+        writer.write_batch(batch)
+    return sink.getvalue()
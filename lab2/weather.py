@@ -0,0 +1,132 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+
+class UpstreamError(Exception):
+    """The weather upstream failed or answered something unusable"""
+
+
+class StaticProvider:
+    """Offline provider, the same report for every city"""
+
+    def __init__(self, weather="sunny"):
+        self.weather = weather
+
+    async def fetch(self, city):
+        return {"weather": self.weather}
+
+    async def aclose(self):
+        pass
+
+
+class HTTPWeatherProvider:
+    """Fetches `GET {base_url}/weather?city=...` through one pooled async HTTP client.
+
+    At most max_connections requests are in flight upstream, and each request,
+    including any wait for a free connection, gives up after `timeout` seconds.
+    """
+
+    def __init__(self, base_url, timeout=2.0, max_connections=20):
+        import httpx
+
+        self.timeout = timeout
+        self._errors = (httpx.HTTPError, ValueError, KeyError, TimeoutError)
+        self._client = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=httpx.Timeout(timeout),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    async def fetch(self, city):
+        try:
+            async with asyncio.timeout(self.timeout):
+                resp = await self._client.get("/weather", params={"city": city})
+            resp.raise_for_status()
+            data = resp.json()
+            return {"weather": data["weather"], "temperature": data["temperature"]}
+        except self._errors as exc:
+            raise UpstreamError(f"{type(exc).__name__}: {exc}") from exc
+
+    async def aclose(self):
+        await self._client.aclose()
+
+
+class WeatherCache:
+    """Per-city reports with a TTL, served stale while a background refresh runs.
+
+    Fresh reports are returned as they are. Reports up to `stale_ttl` seconds past
+    their TTL are returned immediately too, and trigger a refresh in the background.
+    Only a city with no usable report makes the reader wait on the upstream. Each
+    city has at most one fetch in flight, so a slow upstream can't pile up requests.
+    Only the event loop thread touches it.
+    """
+
+    def __init__(self, provider, ttl=300, stale_ttl=3600, maxsize=1024):
+        self.provider = provider
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.stale = 0
+        self.misses = 0
+        self.errors = 0
+        # city -> (fetched_at, report), least recently used first
+        self._reports = OrderedDict()
+        # city -> task fetching it
+        self._fetches = {}
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "stale": self.stale,
+            "misses": self.misses,
+            "errors": self.errors,
+            "in_flight": len(self._fetches),
+            "size": len(self._reports),
+        }
+
+    def _fetch(self, city):
+        task = self._fetches.get(city)
+        if task is None:
+            task = self._fetches[city] = asyncio.get_running_loop().create_task(self._refresh(city))
+            # Background refreshes have no reader; their failure just leaves the stale report in place
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return task
+
+    async def _refresh(self, city):
+        try:
+            report = await self.provider.fetch(city)
+        except UpstreamError:
+            self.errors += 1
+            raise
+        finally:
+            del self._fetches[city]
+        self._reports[city] = (time.monotonic(), report)
+        self._reports.move_to_end(city)
+        while len(self._reports) > self.maxsize:
+            self._reports.popitem(last=False)
+        return report
+
+    async def get(self, city):
+        """The report for city, raises UpstreamError when there is none and the upstream fails"""
+        entry = self._reports.get(city)
+        if entry is not None:
+            age = time.monotonic() - entry[0]
+            if age < self.ttl:
+                self.hits += 1
+                self._reports.move_to_end(city)
+                return entry[1]
+            if age < self.ttl + self.stale_ttl:
+                self.stale += 1
+                self._fetch(city)
+                return entry[1]
+
+        self.misses += 1
+        # Shielded so a reader that disconnects doesn't cancel the fetch other readers share
+        return await asyncio.shield(self._fetch(city))
+
+    async def aclose(self):
+        for task in list(self._fetches.values()):
+            task.cancel()
+        await self.provider.aclose()
@@ -0,0 +1,89 @@
+import argparse
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+CONDITIONS = ("sunny", "cloudy", "rainy", "windy", "snowy")
+
+
+def report(city):
+    """A made-up but stable report for city"""
+    digest = hashlib.blake2b(city.encode(), digest_size=2).digest()
+    return {"city": city, "weather": CONDITIONS[digest[0] % len(CONDITIONS)], "temperature": digest[1] % 40 - 5}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlsplit(self.path)
+        city = parse_qs(url.query).get("city", [""])[0]
+        if url.path != "/weather" or not city:
+            self.send_error(404)
+            return
+        server = self.server
+        with server.lock:
+            server.requests += 1
+        time.sleep(server.delay)
+        body = json.dumps(report(city)).encode()
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client timed out and hung up while we were sleeping
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    """Local stand-in for a weather API, answering every request after `delay` seconds"""
+
+    daemon_threads = True
+    # Room for bursts of new connections; the default backlog of 5 drops SYNs and stalls clients for a second
+    request_queue_size = 128
+
+    def __init__(self, address, delay=0.0):
+        super().__init__(address, StubHandler)
+        self.delay = delay
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def start_stub(port=0, delay=0.0):
+    """Serve the stub from a background thread; returns the server, call stop() when done"""
+    server = StubServer(("127.0.0.1", port), delay)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub weather upstream for tests and benchmarks: GET /weather?city=...")
+    parser.add_argument("--port", type=int, default=8001, help="Bind port (default=8001)")
+    parser.add_argument("--delay", type=float, default=0.0, help="Seconds to wait before answering, to play a slow upstream")
+    args = parser.parse_args()
+
+    server = StubServer(("127.0.0.1", args.port), args.delay)
+    print(f"Stub weather upstream on {server.url} (delay {args.delay}s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
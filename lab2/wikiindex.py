@@ -0,0 +1,150 @@
+import argparse
+import functools
+import gzip
+import mmap
+import os
+import struct
+import tempfile
+
+MAGIC = b"WIKIIDX1"
+# Magic, then the number of titles
+HEADER = struct.Struct("<8sQ")
+OFFSET = struct.Struct("<Q")
+
+# A small titles dump shipped with the repo, used when no real index is configured
+SAMPLE_DUMP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "wiki_titles_sample.txt")
+
+
+def normalize(topic):
+    """Title as Wikipedia writes it in URLs and dumps: trimmed, with underscores for spaces"""
+    return "_".join(topic.replace("_", " ").split())
+
+
+def fold(topic):
+    """Lookup key: normalized and case-folded, so case variants land on the same entries"""
+    return normalize(topic).casefold().encode()
+
+
+def read_titles(path):
+    """Titles from a dump file (one per line, optionally gzipped, like all-titles-in-ns0)"""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            title = normalize(line)
+            if title and title != "page_title":
+                yield title
+
+
+def build_index(titles, path):
+    """Write titles into a sorted index file: header, one offset per entry, then "key\\ttitle\\n" records"""
+    entries = sorted({(fold(title), title.encode()) for title in titles})
+    records = [key + b"\t" + title + b"\n" for key, title in entries]
+    start = HEADER.size + OFFSET.size * len(records)
+    offsets, position = [], start
+    for record in records:
+        offsets.append(position)
+        position += len(record)
+
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(records)))
+        f.write(struct.pack(f"<{len(offsets)}Q", *offsets))
+        f.writelines(records)
+    os.replace(tmp, path)
+    return len(records)
+
+
+@functools.cache
+def sample_index():
+    """Path of an index of the sample dump, built into the temp directory once and shared by every process"""
+    path = os.path.join(tempfile.gettempdir(), f"wiki-titles-sample-{os.stat(SAMPLE_DUMP).st_mtime_ns}.idx")
+    if not os.path.exists(path):
+        build_index(read_titles(SAMPLE_DUMP), path)
+    return path
+
+
+class TitleIndex:
+    """A sorted title index read through mmap.
+
+    Lookups binary search the offset table and only touch the pages they
+    compare against, so the index costs next to no resident memory however
+    many titles it holds.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a title index")
+
+    def __len__(self):
+        return self._count
+
+    def _entry(self, i):
+        start = OFFSET.unpack_from(self._map, HEADER.size + OFFSET.size * i)[0]
+        tab = self._map.find(b"\t", start)
+        end = self._map.find(b"\n", tab)
+        return self._map[start:tab], self._map[tab + 1:end]
+
+    def _key(self, i):
+        start = OFFSET.unpack_from(self._map, HEADER.size + OFFSET.size * i)[0]
+        return self._map[start:self._map.find(b"\t", start)]
+
+    def _lower_bound(self, key):
+        low, high = 0, self._count
+        while low < high:
+            mid = (low + high) // 2
+            if self._key(mid) < key:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def lookup(self, topic):
+        """The canonical title for topic, preferring an exact match over a case variant; None if unknown"""
+        key = fold(topic)
+        if not key:
+            return None
+        wanted = normalize(topic).encode()
+        i = self._lower_bound(key)
+        first = None
+        while i < self._count:
+            entry_key, title = self._entry(i)
+            if entry_key != key:
+                break
+            if title == wanted:
+                return title.decode()
+            if first is None:
+                first = title
+            i += 1
+        return first.decode() if first is not None else None
+
+    def complete(self, prefix, limit=10):
+        """Up to limit titles starting with prefix (case-insensitively), in index order"""
+        key = fold(prefix)
+        titles = []
+        i = self._lower_bound(key)
+        while i < self._count and len(titles) < limit:
+            entry_key, title = self._entry(i)
+            if not entry_key.startswith(key):
+                break
+            titles.append(title.decode())
+            i += 1
+        return titles
+
+    def close(self):
+        self._map.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a memory-mapped title index from a Wikipedia titles dump.")
+    parser.add_argument("dump", help="Titles dump, one title per line (.gz is fine), e.g. enwiki-latest-all-titles-in-ns0.gz")
+    parser.add_argument("index", help="Index file to write")
+    args = parser.parse_args()
+    count = build_index(read_titles(args.dump), args.index)
+    print(f"Indexed {count} titles into {args.index}")
+
+
+if __name__ == "__main__":
+    main()
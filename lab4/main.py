@@ -1,7 +1,8 @@
-from fastapi import FastAPI, Cookie
+from fastapi import FastAPI, Cookie, Response
 from typing import Annotated
 from pydantic import BaseModel
 from fastapi.responses import RedirectResponse
+import primes
 
 app = FastAPI()
 
@@ -35,16 +36,14 @@ async def get_length(text: str):
     return { "text": text, "length": len(text), "description": "This route returns the length of the path argument string." }
 
 @app.get("/prime/{number}")
-async def is_prime(number: int):
-    desc = "This route returns wether the given nember is a prime number."
-    if number < 2:
-        return { "number": number, "is_prime": False, "description": desc }
-
-    for i in range(2, int(number ** 0.5) + 1):
-        if number % i == 0:
-            return { "number": number, "is_prime": False, "description": desc }
-
-    return { "number": number, "is_prime": True, "description": "This route returns whether the given number is a prime number." }
+async def is_prime(number: int, response: Response):
+    result, method, elapsed = primes.timed_check(number)
+    # Expose the engine cost so callers can see it stays flat as inputs grow
+    response.headers["Server-Timing"] = f"prime;desc={method};dur={elapsed * 1000:.3f}"
+    if not result:
+        return { "number": number, "is_prime": False, "method": method, "description": "This route returns wether the given nember is a prime number." }
+
+    return { "number": number, "is_prime": True, "method": method, "description": "This route returns whether the given number is a prime number." }
 
 # Auth methods
 users = (("caua", 28),)
@@ -0,0 +1,90 @@
+import random
+import time
+
+# Numbers below this are answered straight from a precomputed bitset
+SIEVE_LIMIT = 1 << 22
+
+# Miller-Rabin with these bases is exact for every 64-bit n (Sinclair's set)
+DETERMINISTIC_BASES = (2, 325, 9375, 28178, 450775, 9780504, 1795265022)
+DETERMINISTIC_LIMIT = 1 << 64
+
+# Random bases used above the deterministic range (error < 4^-rounds)
+PROBABILISTIC_ROUNDS = 16
+
+SMALL_PRIMES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47)
+
+
+def _build_sieve(limit):
+    """Sieve of Eratosthenes over odd numbers, packed one bit per odd number"""
+    # flags[i] tells whether 2*i + 1 is prime
+    size = limit // 2
+    flags = bytearray(b"\x01") * size
+    flags[0] = 0
+    i = 1
+    while (2 * i + 1) ** 2 < limit:
+        if flags[i]:
+            p = 2 * i + 1
+            start = p * p // 2
+            flags[start::p] = bytes(len(range(start, size, p)))
+        i += 1
+    # Pack the byte flags into bits in C speed: little-endian bit i is flags[i]
+    packed = int(flags[::-1].translate(bytes.maketrans(b"\x00\x01", b"01")), 2)
+    return packed.to_bytes((size + 7) // 8, "little")
+
+
+_sieve = _build_sieve(SIEVE_LIMIT)
+
+
+def _sieve_lookup(n):
+    if n == 2:
+        return True
+    if n < 2 or n % 2 == 0:
+        return False
+    i = n >> 1
+    return bool(_sieve[i >> 3] >> (i & 7) & 1)
+
+
+def _miller_rabin(n, bases):
+    d = n - 1
+    s = 0
+    while d % 2 == 0:
+        d //= 2
+        s += 1
+    for a in bases:
+        a %= n
+        if a == 0:
+            continue
+        x = pow(a, d, n)
+        if x == 1 or x == n - 1:
+            continue
+        for _ in range(s - 1):
+            x = x * x % n
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+
+def check(n):
+    """Return (is_prime, method) where method names the strategy that answered"""
+    if n < SIEVE_LIMIT:
+        return _sieve_lookup(n), "sieve"
+    for p in SMALL_PRIMES:
+        if n % p == 0:
+            return False, "trial"
+    if n < DETERMINISTIC_LIMIT:
+        return _miller_rabin(n, DETERMINISTIC_BASES), "miller-rabin"
+    bases = [random.randrange(2, n - 1) for _ in range(PROBABILISTIC_ROUNDS)]
+    return _miller_rabin(n, bases), "probabilistic"
+
+
+def is_prime(n):
+    return check(n)[0]
+
+
+def timed_check(n):
+    """Same as check() plus the time spent in seconds"""
+    start = time.perf_counter()
+    result, method = check(n)
+    return result, method, time.perf_counter() - start